@@ -1,6 +1,6 @@
 import sqlite3
 import tkinter as tk
-from tkinter import ttk, messagebox, filedialog
+from tkinter import ttk, messagebox, filedialog, simpledialog
 import re
 import os
 import xml.etree.ElementTree as ET
@@ -9,6 +9,19 @@ import pyads
 import sys
 import threading
 import time
+import logging
+import asyncio
+import queue
+import ads_gateway
+import ads_network
+import ads_engine
+import fleet_snapshot
+import lgv_discovery
+import ads_routes
+import ads_sequences
+import ads_pulse
+from ads_log import log
+import ads_log
 
 __version__ = '2.1.2 Beta 12'
 __icon__ = "./plc.ico"
@@ -144,117 +157,226 @@ def load_table_data_from_xml(tree, filename="lgv_data.xml"):
             tc_type = lgv.find("Type").text
             tree.insert("", "end", values=(lgv_name, ams_net_id, tc_type))
     else:
-        print("No saved XML data found, loading default table.")
+        log.info("No saved XML data found, loading default table.")
 
 
 ####################################################################################################################################################################
 ################################################################# ADS connection setup #############################################################################
 ####################################################################################################################################################################
-def monitor_connection_status():
-    global current_ads_connection
+# Calls from the ADS engine and the worker threads, run on the Tk thread by drain_ui_calls.
+# root.after from another thread would block that thread until Tk gets to it.
+UI_DRAIN_INTERVAL_MS = 20
+ui_calls = queue.SimpleQueue()
+
+def call_ui(fn, *args):
+    ui_calls.put((fn, args))
+
+def drain_ui_calls():
+    while True:
+        try:
+            fn, args = ui_calls.get_nowait()
+        except queue.Empty:
+            break
+        try:
+            fn(*args)
+        except Exception:
+            log.exception("Error in %s", getattr(fn, '__name__', fn))
+    root.after(UI_DRAIN_INTERVAL_MS, drain_ui_calls)
+
+async def poll_plc(session, tc_type):
+    # Mapping actions to buttons
+    button_mapping = {
+        'run': run_button,
+        'dis_horn': dis_horn_button
+    }
+    names = {action: plc_symbol(variable_read, action, tc_type, is_core) for action in button_mapping}
+
+    def on_values(values):
+        for action, value in values.items():
+            engine.call_ui(update_button_color, action, button_mapping[action], value)
 
-    if current_ads_connection is None:
-        return
-    
     try:
-        if check_plc_status(current_ads_connection):
-            root.after(0, update_ui_connection_status, "Connected", "green", status_label)
-        else:
-            raise Exception("PLC not in valid state")
+        await ads_engine.poll_values(session, names, on_values)
+    except asyncio.CancelledError:
+        raise
     except Exception as e:
         # assume connection is lost if not status 5 is read
-        disable_control_buttons()
-        root.after(0, update_ui_connection_status, "Disconnected", "red", status_label)
-        close_current_connection()
-
-    t = threading.Timer(1.0, monitor_connection_status)
-    t.daemon = True
-    t.start()  
+        log.warning("Connection lost: %s", e)
+        engine.call_ui(on_connection_lost, session)
 
+def on_connection_lost(session):
+    if current_session is not session:
+        return
+    disable_control_buttons()
+    update_ui_connection_status("Disconnected", "red", status_label)
+    close_current_connection()
     
-def check_plc_status(ads_connection):
-    status = ads_connection.read_state()[0]
-    if status == 5:
-        return True
-    return False
+current_session = None  # ads_engine.AdsSession of current_ads_connection
+poll_task = None
 
-# Close the current connection if it exists
+# Close the current connection if it exists, returns the future of the close
 def close_current_connection():
-    global current_ads_connection, dis_horn_state, connection_in_progress, is_core
+    global current_ads_connection, current_session, poll_task, dis_horn_state, connection_in_progress, is_core
     # with read_lock:
     connection_in_progress = False
     update_ui_connection_status("Disconnected", "red", status_label)
+    engine.cancel(poll_task)
+    poll_task = None
+    release_all_pulses()
     if current_ads_connection:
-        current_ads_connection.close()
+        session = current_session
         current_ads_connection = None
+        current_session = None
         dis_horn_state = False #reset horn state
         is_core = False
         core_status_label.config(text="No Core Lib")
+        return engine.submit(ads_pulse.close_session(session, list(running_pulses)))
+    return None
 
-# Background connection handler (runs in a separate thread)
-def background_connect(plc_data, label):
-    global current_ads_connection, connection_in_progress
+# Open a direct ADS connection, or a shared one through the local gateway
+def open_ads_connection(ams_net_id, port, via_gateway=False, read_timeout=ads_network.DEFAULT_READ_TIMEOUT):
+    if via_gateway:
+        if not ads_gateway.is_gateway_running():
+            ads_gateway.start_gateway_process()
+        connection = ads_gateway.GatewayConnection(ams_net_id, port)
+        connection.open()
+        return connection
+    return ads_network.open_connection(ams_net_id, port, read_timeout)
+
+def create_session(lgv_data, via_gateway, timeouts):
+    lgv_name, ams_net_id, tc_type = lgv_data
+    connect_timeout, read_timeout = timeouts
+    # The first open through the gateway may have to start it, then wait for its own open of the PLC
+    open_timeout = ads_gateway.START_TIMEOUT + ads_gateway.REQUEST_TIMEOUT if via_gateway else None
+    return ads_engine.AdsSession(engine, ams_net_id, ads_network.ads_port_for(tc_type), connect_timeout, read_timeout,
+                                 open_connection=lambda net_id, port, timeout: open_ads_connection(net_id, port, via_gateway, timeout),
+                                 open_timeout=open_timeout)
+
+# Incremented whenever a running connect is abandoned, a connect only publishes its result if it still matches
+connect_generation = 0
+connect_lock = threading.Lock()
+connect_future = None
+
+# Connection handler (runs on the engine loop)
+async def connect_session(plc_data, label, via_gateway=False, speculative=None, generation=0, timeouts=None):
+    global current_ads_connection, current_session, poll_task, connection_in_progress, is_core
 
     # If already connected, don't try to reconnect
     if current_ads_connection is not None:
         return
     
     lgv_name, ams_net_id, tc_type = plc_data
-    port = 851 if tc_type == 'TC3' else 801
-
-    update_ui_connection_status("Connecting...", "orange", label)
+    timeouts = timeouts or (ads_network.DEFAULT_CONNECT_TIMEOUT, ads_network.DEFAULT_READ_TIMEOUT)
 
+    session = None
     try:        
-        # Attempt to open a new connection
-        current_ads_connection = pyads.Connection(ams_net_id, port)
-        current_ads_connection.open()
-
-        # Check PLC status
-        if check_plc_status(current_ads_connection):
-            update_ui_connection_status("Connected", "green", label)
-            enable_control_buttons()
+        # Reuse the pre-connected session if there is one, otherwise open a new connection
+        claimed = await claim_speculative_session(speculative) if speculative else None
+        if claimed:
+            session, core_detected = claimed
+            # The PLC may have left RUN since the speculative connect, try once more on a fresh connection
+            try:
+                await ads_engine.check_running(session)
+            except Exception as e:
+                log.info("Pre-connected session to %s not usable (%s), reconnecting", lgv_name, e)
+                await session.close()
+                session = claimed = None
+        if not claimed:
+            session = create_session(plc_data, via_gateway, timeouts)
+            await session.connect()
+            # Check PLC status
+            await ads_engine.check_running(session)
+
+        # Automatically detect core variable
+        if not claimed:
+            core_detected = await session.call(detect_core_library)
+
+        with connect_lock:
+            cancelled = generation != connect_generation
+            if not cancelled:
+                current_ads_connection = session.connection
+                current_session = session
+                is_core = core_detected
+        # Another LGV was selected meanwhile, drop this connection
+        if cancelled:
+            await session.close()
+            return
 
-            # Automatically detect core variable
-            check_for_core_variable()
-            # Call update_buttons once to start the loop
-            # update_buttons()
-            update_buttons_from_plc_thread()
+        engine.call_ui(on_connected, session, label)
 
-            # Start monitoring the connection after connecting
-            monitor_connection_status()
+        # Start polling and monitoring the connection after connecting
+        poll_task = asyncio.ensure_future(poll_plc(session, tc_type))
 
-        else:
-            raise Exception("PLC not in a valid state")
+    except asyncio.CancelledError:
+        if session is not None:
+            await session.close()
+        raise
 
     except Exception as e:
-        current_ads_connection = None
-        disable_control_buttons()
-        update_ui_connection_status("Disconnected", "red", label)
-        messagebox.showerror("Connection Error", f"Failed to connect to {lgv_name}: {str(e)}")
-        treeview.selection_remove(treeview.selection())
-        is_core = False
+        if session is not None:
+            await session.close()
+        if generation != connect_generation:
+            return
+        # Logged instead of a dialog from the engine thread, shown in the log pane
+        log.error("Failed to connect to %s: %s", lgv_name, e)
+        engine.call_ui(on_connect_failed, label)
 
     finally:
+        if generation == connect_generation:
+            connection_in_progress = False
+
+def on_connected(session, label):
+    if current_session is not session:
+        return
+    update_ui_connection_status("Connected", "green", label)
+    enable_control_buttons()
+    core_status_label.config(text="Core Lib" if is_core else "No Core Lib")
+
+def on_connect_failed(label):
+    global is_core
+    if current_ads_connection is not None:
+        return
+    disable_control_buttons()
+    update_ui_connection_status("Disconnected", "red", label)
+    treeview.selection_remove(treeview.selection())
+    is_core = False
+
+# Abandon the running connect, it closes its connection when cancelled
+def cancel_connect():
+    global connect_generation, connection_in_progress, connect_future
+    with connect_lock:
+        connect_generation += 1
         connection_in_progress = False
-        if current_ads_connection is None:
-            update_ui_connection_status("Disconnected", "red", label)
+    if connect_future is not None:
+        connect_future.cancel()
+        connect_future = None
+    update_ui_connection_status("Disconnected", "red", status_label)
+
+# Connect and read timeouts for the next session, from the spinboxes
+def get_session_timeouts():
+    try:
+        connect_timeout = float(connect_timeout_var.get())
+        read_timeout = float(read_timeout_var.get())
+    except (tk.TclError, ValueError):
+        return ads_network.DEFAULT_CONNECT_TIMEOUT, ads_network.DEFAULT_READ_TIMEOUT
+    return max(connect_timeout, 0.1), max(read_timeout, 0.1)
 
 # Update the UI status label (called from the main thread)
 def update_ui_connection_status(text, color, label):
     label.config(text=text, foreground=color)
 
-# Attempt to connect to the selected PLC (starts in a new thread)
+# Attempt to connect to the selected PLC (runs on the ADS engine)
 def connect_to_plc(tree, label):
-    global connection_in_progress, current_ads_connection
+    global connection_in_progress, current_ads_connection, connect_future
     
     if connection_in_progress:
-        print("Connection in progress. Waiting for it to finish. Triggered on connect")
+        log.info("Connection in progress. Waiting for it to finish. Triggered on connect")
         messagebox.showinfo("Attention", "Connection in progress. Waiting for it to finish. Triggered on connect")
         return
     
     # If already connected, don't try to reconnect
     if current_ads_connection is not None:
-        print("Target already connected")
+        log.info("Target already connected")
         messagebox.showinfo("Attention", "Target already connected")
         return
     
@@ -262,15 +384,18 @@ def connect_to_plc(tree, label):
     selected_item = tree.selection()
     if not selected_item:
         # messagebox.showinfo("Attention", "Select LGV")
-        print("No LGV selected")
+        log.debug("No LGV selected")
         return
 
     lgv_data = tree.item(selected_item)["values"]
+    via_gateway = use_gateway.get()
 
-    # Start the connection in a new thread
-    connection_thread = threading.Thread(target=background_connect, args=(lgv_data, label))
-    connection_thread.start()
+    # Hand over a matching pre-connected session, cancel any other
+    speculative = take_speculative_session(lgv_data, via_gateway)
+
+    update_ui_connection_status("Connecting...", "orange", label)
     connection_in_progress = True
+    connect_future = engine.submit(connect_session(lgv_data, label, via_gateway, speculative, connect_generation, get_session_timeouts()))
 
 
 previous_selection = None # track previous connection
@@ -286,14 +411,13 @@ def on_treeview_select(event):
         return
     
     if connection_in_progress:
-        treeview.selection_remove(treeview.selection())
-        print("Connection in progress. Waiting for it to finish. Triggered on select")
-        messagebox.showinfo("Attention", "Connection in progress. Waiting for it to finish. Triggered on select")
-        return
+        # Give up on the running connect rather than refusing the new selection
+        log.info("Connection in progress cancelled. Triggered on select")
+        cancel_connect()
 
     # If the same item is selected, do nothing
     if (previous_selection == selected_item) and current_ads_connection:
-        print("Target already connected")
+        log.info("Target already connected")
         messagebox.showinfo("Attention", "Target already connected")
         return
 
@@ -310,6 +434,126 @@ def on_treeview_select(event):
     
     update_ui_connection_status("Disconnected", "red", status_label)
 
+    if preconnect_enabled.get():
+        schedule_preconnect(treeview.item(selected_item)["values"], PRECONNECT_SELECT_DELAY_MS)
+
+
+####################################################################################################################################################################
+################################################################ Speculative pre-connect ###########################################################################
+####################################################################################################################################################################
+# With pre-connect enabled, the handshake and core detection for a row start as soon as it is selected,
+# or hovered for a moment. Connect then only has to adopt the ready session. A speculative session never
+# touches the globals or the control buttons, those are only set once the user clicks Connect.
+PRECONNECT_SELECT_DELAY_MS = 150
+PRECONNECT_HOVER_DELAY_MS = 400
+
+speculative_session = None  # Current pre-connect attempt: {'key', 'future'}, see start_preconnect
+preconnect_after_id = None
+hovered_row = None
+
+def schedule_preconnect(lgv_data, delay_ms):
+    global preconnect_after_id
+    if preconnect_after_id is not None:
+        root.after_cancel(preconnect_after_id)
+    preconnect_after_id = root.after(delay_ms, start_preconnect, lgv_data, use_gateway.get())
+
+def start_preconnect(lgv_data, via_gateway):
+    global speculative_session, preconnect_after_id
+    preconnect_after_id = None
+
+    if connection_in_progress:
+        return
+    key = (tuple(lgv_data), via_gateway)
+    if speculative_session is not None and speculative_session['key'] == key:
+        return
+    cancel_preconnect()
+
+    future = engine.submit(speculative_connect(lgv_data, via_gateway, get_session_timeouts()))
+    speculative_session = {'key': key, 'future': future}
+
+# Returns (session, core detected), the session is closed if the pre-connect gets cancelled
+async def speculative_connect(lgv_data, via_gateway, timeouts):
+    session = create_session(lgv_data, via_gateway, timeouts)
+    try:
+        await session.connect()
+        await ads_engine.check_running(session)
+        return session, await session.call(detect_core_library)
+    except asyncio.CancelledError:
+        await session.close()
+        raise
+    except Exception as e:
+        await session.close()
+        log.warning("Pre-connect to %s failed: %s", lgv_data[0], e, extra={'symbol': f"preconnect:{lgv_data[0]}"})
+        raise
+
+# Close the session of a pre-connect that already finished
+def discard_speculative_result(future):
+    if not future.cancelled() and future.exception() is None:
+        engine.submit(future.result()[0].close())
+
+# Drop the pending or ready speculative session
+def cancel_preconnect():
+    global speculative_session, preconnect_after_id
+    if preconnect_after_id is not None:
+        root.after_cancel(preconnect_after_id)
+        preconnect_after_id = None
+
+    session, speculative_session = speculative_session, None
+    if session is None:
+        return
+    # Cancels a running handshake, closes a finished one
+    session['future'].cancel()
+    session['future'].add_done_callback(discard_speculative_result)
+
+# Called by connect: returns the session for this LGV (ready or still connecting), None otherwise
+def take_speculative_session(lgv_data, via_gateway):
+    global speculative_session, preconnect_after_id
+    if preconnect_after_id is not None:
+        root.after_cancel(preconnect_after_id)
+        preconnect_after_id = None
+
+    session = speculative_session
+    if session is not None and session['key'] == (tuple(lgv_data), via_gateway):
+        speculative_session = None
+        return session
+    cancel_preconnect()
+    return None
+
+# Wait for the handshake to finish and take its session, None if it failed
+async def claim_speculative_session(speculative):
+    try:
+        return await asyncio.wrap_future(speculative['future'])
+    except asyncio.CancelledError:
+        # The connect itself is being cancelled, a finished pre-connect still has to be closed
+        speculative['future'].add_done_callback(discard_speculative_result)
+        raise
+    except Exception:
+        return None
+
+def on_treeview_motion(event):
+    global hovered_row
+    row = treeview.identify_row(event.y)
+    if row == hovered_row:
+        return
+    hovered_row = row
+    # Only pre-connect on hover while nothing is selected, selection takes over otherwise
+    if not row or not preconnect_enabled.get() or treeview.selection() or current_ads_connection is not None:
+        return
+    schedule_preconnect(treeview.item(row)["values"], PRECONNECT_HOVER_DELAY_MS)
+
+def on_treeview_leave(event):
+    global hovered_row, preconnect_after_id
+    hovered_row = None
+    if preconnect_after_id is not None and not treeview.selection():
+        root.after_cancel(preconnect_after_id)
+        preconnect_after_id = None
+
+def on_preconnect_toggle():
+    if not preconnect_enabled.get():
+        cancel_preconnect()
+    elif treeview.selection() and current_ads_connection is None:
+        schedule_preconnect(treeview.item(treeview.selection())["values"], PRECONNECT_SELECT_DELAY_MS)
+
 # Enable control buttons after a successful connection
 def enable_control_buttons():
     lgv_buttons = (reset_button, run_button, stop_button, man_auto_button, dis_horn_button)
@@ -325,11 +569,169 @@ def disable_control_buttons():
         button.config(style="LGV.TButton")
         button.config(state="disabled")
 
+# Probe every LGV in the table at once and colour the rows by result
+def check_all_lgvs():
+    rows = treeview.get_children()
+    if not rows:
+        return
+    targets = []
+    for row in rows:
+        lgv_name, ams_net_id, tc_type = treeview.item(row)["values"]
+        targets.append((ams_net_id, ads_network.ads_port_for(tc_type)))
+
+    check_all_button.config(state="disabled")
+    threading.Thread(target=background_check_all, args=(rows, targets, get_session_timeouts()), daemon=True).start()
+
+def background_check_all(rows, targets, timeouts):
+    connect_timeout, read_timeout = timeouts
+    results = ads_network.probe_targets(targets, connect_timeout=connect_timeout, read_timeout=read_timeout)
+    call_ui(show_check_results, rows, results)
+
+def show_check_results(rows, results):
+    for row, result in zip(rows, results):
+        if not treeview.exists(row):
+            continue
+        if result['state'] == 5:
+            tag = 'online'
+        elif result['reachable']:
+            tag = 'reachable'
+        else:
+            tag = 'offline'
+        treeview.item(row, tags=(tag,))
+    check_all_button.config(state="normal")
+
+# Scan an IP range for ADS endpoints and merge them into the table
+discovery_range = None  # Last range scanned, offered again next time
+
+def discover_lgvs():
+    global discovery_range
+    if discovery_range is None:
+        rows = treeview.get_children()
+        # Default to the subnet of the first LGV in the table
+        if rows:
+            ip = ads_network.ip_from_net_id(str(treeview.item(rows[0])["values"][1]))
+            discovery_range = ip.rsplit(".", 1)[0] + ".1-254"
+        else:
+            discovery_range = ""
+
+    spec = simpledialog.askstring("Discover LGVs", "IP range (e.g. 10.40.10.1-254 or 10.40.10.0/24)",
+                                  initialvalue=discovery_range, parent=root)
+    if not spec:
+        return
+    try:
+        addresses = lgv_discovery.parse_ip_range(spec)
+    except ValueError as e:
+        messagebox.showerror("Error", f"Invalid IP range: {e}")
+        return
+    discovery_range = spec
+
+    discover_button.config(state="disabled")
+    log.info("Scanning %d addresses for LGVs", len(addresses))
+    connect_timeout, read_timeout = get_session_timeouts()
+    engine.submit(run_blocking(lambda: lgv_discovery.discover(addresses, connect_timeout=connect_timeout, read_timeout=read_timeout)),
+                  on_done=on_discovery_done)
+
+# Long blocking job (scan, route provisioning) on one of the engine's io threads. The job fans its
+# probes out on a pool of its own, on the io threads they would hold up the lamp polling for seconds.
+async def run_blocking(fn):
+    return await asyncio.get_running_loop().run_in_executor(engine.executor, fn)
+
+def on_discovery_done(done):
+    discover_button.config(state="normal")
+    try:
+        discovered = done.result()
+    except Exception as e:
+        log.error("LGV discovery failed: %s", e)
+        return
+    fleet = [tuple(treeview.item(row)["values"]) for row in treeview.get_children()]
+    merged, added, updated = lgv_discovery.merge_discovered(fleet, discovered)
+    log.info("Discovery found %d LGVs: %d added, %d TC type updated", len(discovered), added, updated)
+    if not added and not updated:
+        return
+
+    # Update the rows in place, so the selection and an open connection are kept
+    rows = {str(treeview.item(row)["values"][1]): row for row in treeview.get_children()}
+    for item in merged:
+        if item[1] in rows:
+            treeview.item(rows[item[1]], values=item)
+        else:
+            treeview.insert("", "end", values=item)
+    save_table_data_to_xml(treeview)
+
+# Add or verify the ADS route to every LGV in the table, with a per-LGV status window
+DEFAULT_ROUTE_USERNAME = "Administrator"
+
+route_view = {}  # Widgets of the route status window
+
+def provision_routes():
+    lgvs = [tuple(treeview.item(row)["values"]) for row in treeview.get_children()]
+    if not lgvs:
+        return
+    username = simpledialog.askstring("ADS routes", "PLC user name", initialvalue=DEFAULT_ROUTE_USERNAME, parent=root)
+    if username is None:
+        return
+    password = simpledialog.askstring("ADS routes", "PLC password", show="*", parent=root)
+    if password is None:
+        return
+    known = ads_routes.load_routes()
+    force = any(lgv[1] in known for lgv in lgvs) and messagebox.askyesno("ADS routes", "Check again the routes saved earlier?")
+
+    open_route_window(lgvs)
+    routes_button.config(state="disabled")
+    connect_timeout, read_timeout = get_session_timeouts()
+    engine.submit(run_blocking(lambda: ads_routes.provision_fleet(lgvs, username, password, force=force,
+                                                                  on_result=lambda result: call_ui(show_route_result, result),
+                                                                  connect_timeout=connect_timeout, read_timeout=read_timeout)),
+                  on_done=on_routes_done)
+
+def on_routes_done(done):
+    routes_button.config(state="normal")
+    try:
+        results = done.result()
+    except Exception as e:
+        log.error("Route provisioning failed: %s", e)
+        return
+    failed = sum(1 for result in results if result['status'] in (ads_routes.STATUS_FAILED, ads_routes.STATUS_REMOTE_ONLY))
+    log.info("Route provisioning done: %d LGVs, %d failed", len(results), failed)
+
+def open_route_window(lgvs):
+    window = route_view.get('window')
+    if window is None or not window.winfo_exists():
+        window = tk.Toplevel(root)
+        window.title("ADS routes")
+        tree = ttk.Treeview(window, columns=("Name", "NetId", "Status", "Attempts", "Detail"), show="headings", height=20)
+        for col, width in (("Name", 80), ("NetId", 120), ("Status", 80), ("Attempts", 70), ("Detail", 300)):
+            tree.heading(col, text=headings.get(col, col), anchor='w')
+            tree.column(col, width=width, anchor='w')
+        tree.tag_configure(ads_routes.STATUS_FAILED, foreground='red')
+        tree.tag_configure(ads_routes.STATUS_ADDED, foreground='green')
+        tree.tag_configure(ads_routes.STATUS_PRESENT, foreground='green')
+        tree.tag_configure(ads_routes.STATUS_REMOTE_ONLY, foreground='orange')
+        tree.tag_configure(ads_routes.STATUS_KNOWN, foreground='gray')
+        tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        route_view.update(window=window, tree=tree)
+    else:
+        window.lift()
+
+    tree = route_view['tree']
+    for row in tree.get_children():
+        tree.delete(row)
+    route_view['rows'] = {lgv[1]: tree.insert("", "end", values=(lgv[0], lgv[1], "Pending...", "", "")) for lgv in lgvs}
+
+def show_route_result(result):
+    window = route_view.get('window')
+    if window is None or not window.winfo_exists():
+        return
+    row = route_view['rows'].get(result['net_id'])
+    if row is not None:
+        route_view['tree'].item(row, values=(result['name'], result['net_id'], result['status'], result['attempts'] or "", result['detail']),
+                                tags=(result['status'],))
+
 def on_core_check():
     if is_core:
-        print("Core library present")
+        log.info("Core library present")
     else:
-        print("Normal library")
+        log.info("Normal library")
 
 
 ####################################################################################################################################################################
@@ -365,70 +767,74 @@ variable_write = {
 }
 
 
-def write_variable(action, tc_type, is_core, value, button):
-    global current_ads_connection
-
-    # Select the appropriate variable name for the action, based on tc_type and is_core
-    if tc_type == 'TC2':
-        variable_name = variable_write[action]['TC2']  # For TC2, ignore is_core
-    else:
-        variable_name = variable_write[action][('TC3', is_core)]  # For TC3, consider is_core
-
-    if current_ads_connection is not None:
-        try:
-            # Write the value to the PLC
-            current_ads_connection.write_by_name(variable_name, value, pyads.PLCTYPE_BOOL)
-            print(f"Successfully wrote {value} to {variable_name} for action: {action}")
-            return True
-        except Exception as e:
-            messagebox.showerror("Write Error", f"Failed to write to {variable_name}: {str(e)}")
-            print(f"Failed to write to {variable_name}: {str(e)}")
-        finally:
-            button.config(state="normal")
-            # Delay resetting the button's visual state to avoid it appearing pressed
-            button.after(0, lambda: button.state(['!pressed', '!active']))  # Slight delay
-
-    else:
-        print("Connection Error", "No active connection to write to.")
-        # messagebox.showerror("Connection Error", "No active connection to write to.")
-    return False
-    
-
 # Variable to track toggle state for dis_horn
 
-def on_dis_horn_button_click(button):
-    global dis_horn_state
-
-    # Get initial state of dis_horn variable to toggle it
-    dis_horn_state = read_variable('dis_horn') 
+# Read the horn bit and write it inverted, on the engine like the other buttons
+async def toggle_dis_horn(session, read_name, write_name):
+    value = not await session.read_by_handle(read_name, pyads.PLCTYPE_BOOL)
+    await session.write_by_handle(write_name, value, pyads.PLCTYPE_BOOL)
+    return value
 
+def on_dis_horn_button_click(button):
     lgv_data = get_lgv_data()
     
-    if lgv_data is None:
+    if lgv_data is None or current_session is None:
+        log.warning("No active connection to write to.")
         return
     tc_type = lgv_data[2]
 
-    # Toggle the state of dis_horn
-    dis_horn_state = not dis_horn_state
-    success_write = write_variable('dis_horn', tc_type, is_core, dis_horn_state, button)
-    if success_write:   
-        print(f"Disable Horn pressed, value: {dis_horn_state}")
+    session = current_session
+    read_name = plc_symbol(variable_read, 'dis_horn', tc_type, is_core)
+    write_name = plc_symbol(variable_write, 'dis_horn', tc_type, is_core)
+    engine.submit(toggle_dis_horn(session, read_name, write_name),
+                  on_done=lambda done: on_dis_horn_done(done, session, button))
+
+def on_dis_horn_done(done, session, button):
+    global dis_horn_state
+    button.config(state="normal")
+    # Reset the button's visual state to avoid it appearing pressed
+    button.state(['!pressed', '!active'])
+    if current_session is not session:
+        return
+    error = done.exception() if not done.cancelled() else "cancelled"
+    if error is None:
+        dis_horn_state = done.result()
+        log.info("Disable Horn pressed, value: %s", dis_horn_state)
     else:
-        dis_horn_state= False
-        print(f"Disable Horn presse unsuccessful, value: {dis_horn_state}")
+        dis_horn_state = False
+        log.warning("Disable Horn press unsuccessful, value: %s (%s)", dis_horn_state, error)
 
 press_successful = False
 cooldown_active = False  # Variable to track cooldown state
 interaction_in_progress = False # Track pres-release cycle
 
+# Hold-to-run pulses of the control buttons by action. The release is written by the button release,
+# or at the latest by the watchdog on the ADS engine after MAX_BUTTON_HOLD seconds.
+MAX_BUTTON_HOLD = ads_pulse.DEFAULT_MAX_HOLD
+held_pulses = {}
+running_pulses = []     # Pressed or still writing the release
+
 def on_button_action(action, value, button, is_release=False):
     global press_successful, cooldown_active, interaction_in_progress
 
-    if cooldown_active:
+    if is_release:
+        # Always let a held pulse go, whatever the cooldown or the button state
+        pulse = held_pulses.pop(action, None)
+        if pulse is None:
+            return
+        pulse.release()
+        if action in ['reset', 'stop', 'man_auto']:
+            button.config(style="LGV.TButton")
+        if interaction_in_progress:
+            interaction_in_progress = False
+            cooldown_active = True
+            button.after(100, lambda: end_cooldown())  # End cooldown after 100ms
+        return
+
+    if cooldown_active or action in held_pulses:
         return
     
-    if not is_release:
-        interaction_in_progress = True
+    interaction_in_progress = True
     
     button_state = button.cget("state").string
     if  button_state != 'normal':
@@ -436,34 +842,56 @@ def on_button_action(action, value, button, is_release=False):
     
     lgv_data = get_lgv_data()
     
-    if lgv_data is None:
+    if lgv_data is None or current_session is None:
         # messagebox.showerror("Error", "No LGV selected or invalid data.")
         press_successful = False
         return
     tc_type = lgv_data[2]
 
-    # Write the value (True or False) for the specific action
-    press_successful = write_variable(action, tc_type, is_core, value, button)
+    # Write the value (True or False) for the specific action on the ADS engine
+    variable_name = plc_symbol(variable_write, action, tc_type, is_core)
+    pulse = ads_pulse.HeldPulse(engine, current_session, variable_name, value, MAX_BUTTON_HOLD,
+                                on_pressed=lambda ok: on_button_pressed(action, value, button, ok),
+                                on_done=lambda report: on_pulse_done(action, button, report))
+    held_pulses[action] = pulse
+    running_pulses.append(pulse)
 
-    # press_successful = True
+def on_button_pressed(action, value, button, ok):
+    global press_successful
+    press_successful = ok
 
-    # Change button color only for reset, stop, and man_auto actions
-    if action in ['reset', 'stop', 'man_auto']:
-        # Change button color based on press/release value
-        if value and press_successful:  # If pressed (True)
+    # Change button color only for reset, stop, and man_auto actions, while it is still held
+    if action in ['reset', 'stop', 'man_auto'] and action in held_pulses:
+        if value and ok:  # If pressed (True)
             button.config(style="LGV.Pressed.TButton")
         else:  # If released (False)
             button.config(style="LGV.TButton")
-    
-    if is_release and interaction_in_progress:
-        interaction_in_progress = False
-        cooldown_active = True
-        button.after(100, lambda: end_cooldown())  # End cooldown after 500ms
 
-    if press_successful:    
-        print(f"Button {action} is pressed and value is {value}")
+    if ok:    
+        log.info("Button %s is pressed and value is %s", action, value)
     else:
-        print(f"Press {action} unsuccessful")
+        log.warning("Press %s unsuccessful", action)
+
+def on_pulse_done(action, button, report):
+    # The watchdog released the bit while the button is still held, a new press is needed
+    pulse = held_pulses.get(action)
+    if pulse is not None and pulse.report is report:
+        del held_pulses[action]
+        button.config(style="LGV.TButton")
+    running_pulses[:] = [pulse for pulse in running_pulses if pulse.report is not report]
+    if report['error']:
+        log.error("Pulse %s failed: %s", action, report['error'])
+    else:
+        log.info("Pulse %s: %s", action, ads_pulse.format_report(report))
+
+# Release every held pulse, e.g. when the window loses focus and the release event may never come
+def release_all_pulses():
+    for action in list(held_pulses):
+        held_pulses.pop(action).release()
+
+def on_focus_out(event):
+    # Focus moving between widgets of the window is not a loss of focus
+    root.after(10, lambda: release_all_pulses() if root.focus_get() is None else None)
 
 def end_cooldown():
     global cooldown_active
@@ -471,23 +899,18 @@ def end_cooldown():
 
 
 def bind_button_actions(button, action, press_value=True, release_value=False):
-    global press_successful
 
     def on_button_press(event):
         on_button_action(action, press_value, button)
     
     def on_button_release(event):
-        if press_successful:
-            on_button_action(action, release_value, button, is_release=True)
-        # else:
-        #     button.config(state="normal")
-        #     # Delay resetting the button's visual state to avoid it appearing pressed
-        #     button.after(10, lambda: button.state(['!pressed', '!active']))  # Slight delay
-        # # Shift focus away after a small delay
-        # # button.after(50, lambda: button.winfo_toplevel().focus_force())
+        # Released whether or not the press was confirmed yet, the pulse writes the release in any case
+        on_button_action(action, release_value, button, is_release=True)
 
     button.bind("<ButtonPress>", lambda event: on_button_press(event))
     button.bind("<ButtonRelease>", lambda event: on_button_release(event))
+    # Dragging off the button does not always deliver the release to it
+    button.bind("<Leave>", lambda event: on_button_release(event))
 
 # def on_button_action_wrapper(action, press_value, release_value, button):
 #     global press_successful
@@ -558,41 +981,17 @@ variable_read = {
 # Variable to store core status
 is_core = False
 
-def check_for_core_variable():
-    global is_core 
+def detect_core_library(ads_connection):
     try:
-        # Attempt to read the core variable
-        core_value = current_ads_connection.read_by_name("CoreGVL.ADS_Run", pyads.PLCTYPE_BOOL)
-        
-        # If the core variable is read successfully, set the variable and update the label
-        if core_value is not None:
-            is_core = True  # Set the variable to True (core detected)
-            core_status_label.config(text="Core Lib")
-        else:
-            is_core = False  # Set the variable to False (core not detected)
-            core_status_label.config(text="No Core Lib")
-            
+        # Attempt to read the core variable, it only exists with the core library
+        return ads_connection.read_by_name("CoreGVL.ADS_Run", pyads.PLCTYPE_BOOL) is not None
     except Exception as e:
-        is_core = False  # Handle error, set core status to "not detected"
-        core_status_label.config(text="No Core Lib")
-
+        return False
 
-def read_variable(action):
-    lgv_data = get_lgv_data()
-    tc_type = lgv_data[2]
-    is_core_value = is_core
 
-    # Fetch the variable name based on the TC type and is_core flag
-    var_name = variable_read[action].get(tc_type) if tc_type == "TC2" else variable_read[action].get((tc_type, is_core_value))
-
-    if var_name and current_ads_connection is not None:
-        # Read the value from the PLC
-        try:
-            return current_ads_connection.read_by_name(var_name, pyads.PLCTYPE_BOOL)
-        except Exception as e:
-            print(f"Error reading variable {var_name}: {e}")
-            return None
-    return None
+# Fetch the variable name of an action based on the TC type and is_core flag
+def plc_symbol(variables, action, tc_type, is_core_value):
+    return variables[action].get(tc_type) if tc_type == "TC2" else variables[action].get((tc_type, is_core_value))
 
 def update_button_color(action, button, read_value):
     if read_value is None:
@@ -603,63 +1002,262 @@ def update_button_color(action, button, read_value):
     else:  # If the PLC variable is False
         button.configure(style='LGV.Disconnected.TButton')
 
-def update_buttons():
-    if current_ads_connection is None:
+####################################################################################################################################################################
+################################################################## Command sequences ###############################################################################
+####################################################################################################################################################################
+sequence_view = {}  # Widgets and running job of the sequence window
+
+def sequence_resolver(tc_type, core):
+    def resolve(kind, symbol):
+        variables = variable_write if kind == 'write' else variable_read
+        if symbol in variables:
+            return plc_symbol(variables, symbol, tc_type, core)
+        return symbol
+    return resolve
+
+# Run a sequence on one LGV, always on a session of its own: closing the connected session
+# (selection change, lost connection) must not cut a pulse of a running sequence short
+async def run_sequence_on_lgv(lgv_data, steps, via_gateway, timeouts):
+    lgv_name, ams_net_id, tc_type = lgv_data
+    session = create_session(lgv_data, via_gateway, timeouts)
+    try:
+        await session.connect()
+        core = await session.call(detect_core_library)
+
+        def on_step(index, step, seconds):
+            log.debug("%s: step %d (%s) done in %.3f s", lgv_name, index, step['op'], seconds)
+
+        return await ads_sequences.run_sequence(session, steps, sequence_resolver(tc_type, core), on_step)
+    finally:
+        await session.close()
+
+async def run_sequence_on_fleet(lgvs, name, steps, via_gateway, timeouts):
+    results = await asyncio.gather(*(run_sequence_on_lgv(lgv, steps, via_gateway, timeouts) for lgv in lgvs), return_exceptions=True)
+    for lgv, result in zip(lgvs, results):
+        if isinstance(result, BaseException):
+            log.error("Sequence %s on %s failed: %s", name, lgv[0], result)
+        else:
+            log.info("Sequence %s on %s done in %.2f s", name, lgv[0], sum(seconds for op, seconds in result))
+    return list(zip(lgvs, results))
+
+def open_sequence_window():
+    window = sequence_view.get('window')
+    if window is not None and window.winfo_exists():
+        window.lift()
+        return
+    try:
+        sequences = ads_sequences.load_sequences()
+    except Exception as e:
+        messagebox.showerror("Error", f"Could not load sequences: {e}")
         return
-    # Read variables and update button colors for all actions
-    actions = ['reset', 'run', 'stop', 'man_auto', 'dis_horn']
-    
-    # Mapping actions to buttons
-    button_mapping = {
-        'reset': reset_button,
-        'run': run_button,
-        'stop': stop_button,
-        'man_auto': man_auto_button,
-        'dis_horn': dis_horn_button
-    }
-    
-    for action in actions:
-        read_value = read_variable(action)  # Read value from PLC
-        button = button_mapping[action]
-        update_button_color(action, button, read_value)
-    
-    # Schedule the function to run again after 2s
-    root.after(50, update_buttons)
 
-read_lock = threading.Lock()
+    window = tk.Toplevel(root)
+    window.title("Command sequences")
+
+    sequence_var = tk.StringVar(value=next(iter(sequences)))
+    ttk.Combobox(window, textvariable=sequence_var, values=list(sequences), state="readonly").pack(fill='x', padx=10, pady=(10, 5))
+
+    lgv_list = tk.Listbox(window, selectmode=tk.MULTIPLE, height=12, exportselection=False)
+    lgv_list.pack(fill=tk.BOTH, expand=True, padx=10)
+    lgvs = [tuple(treeview.item(row)["values"]) for row in treeview.get_children()]
+    for index, lgv in enumerate(lgvs):
+        lgv_list.insert("end", f"{lgv[0]}  ({lgv[1]})")
+        # Preselect the connected LGV
+        if current_session is not None and current_session.ams_net_id == lgv[1]:
+            lgv_list.selection_set(index)
+
+    buttons = ttk.Frame(window)
+    buttons.pack(fill='x', padx=10, pady=5)
+    run_sequence_button = ttk.Button(buttons, text="Run", command=run_selected_sequence)
+    run_sequence_button.pack(side=tk.LEFT)
+    ttk.Button(buttons, text="Cancel", command=cancel_sequence).pack(side=tk.LEFT, padx=5)
+
+    result_label = ttk.Label(window, text="", justify='left')
+    result_label.pack(fill='x', padx=10, pady=(0, 10))
+
+    sequence_view.clear()
+    sequence_view.update(window=window, sequences=sequences, sequence_var=sequence_var, lgv_list=lgv_list, lgvs=lgvs,
+                         run_button=run_sequence_button, result_label=result_label, future=None)
+
+def run_selected_sequence():
+    lgvs = [sequence_view['lgvs'][index] for index in sequence_view['lgv_list'].curselection()]
+    if not lgvs:
+        return
+    name = sequence_view['sequence_var'].get()
+    steps = sequence_view['sequences'][name]
+    sequence_view['run_button'].config(state="disabled")
+    sequence_view['result_label'].config(text=f"Running {name} on {len(lgvs)} LGVs...")
+    sequence_view['future'] = engine.submit(run_sequence_on_fleet(lgvs, name, steps, use_gateway.get(), get_session_timeouts()),
+                                            on_done=on_sequence_done)
+
+def cancel_sequence():
+    future = sequence_view.get('future')
+    if future is not None:
+        future.cancel()
+
+def on_sequence_done(future):
+    sequence_view['future'] = None
+    window = sequence_view.get('window')
+    if window is None or not window.winfo_exists():
+        return
+    sequence_view['run_button'].config(state="normal")
+    if future.cancelled():
+        sequence_view['result_label'].config(text="Cancelled")
+        return
+    lines = []
+    for lgv, result in future.result():
+        if isinstance(result, BaseException):
+            lines.append(f"{lgv[0]}: failed, {result}")
+        else:
+            lines.append(f"{lgv[0]}: done in {sum(seconds for op, seconds in result):.2f} s")
+    sequence_view['result_label'].config(text="\n".join(lines))
 
-def update_buttons_from_plc_thread():
-    global current_ads_connection
 
-    # if current_ads_connection is None:
-    #     return
-        
-    # Read variables and update button colors for all actions
-    # actions = ['reset', 'run', 'stop', 'man_auto', 'dis_horn']
-    actions = ['run', 'dis_horn']
-    
-    # Mapping actions to buttons
-    button_mapping = {
-        # 'reset': reset_button,
-        'run': run_button,
-        # 'stop': stop_button,
-        # 'man_auto': man_auto_button,
-        'dis_horn': dis_horn_button
-    }
-    
-    # with read_lock:
-    for action in actions:
-        if current_ads_connection is None:
-            return
-        read_value = read_variable(action)  # Read value from PLC
-        button = button_mapping[action]
-    
-        root.after(0, update_button_color, action, button, read_value)
-    
+####################################################################################################################################################################
+#################################################################### Fleet snapshot ################################################################################
+####################################################################################################################################################################
+# Symbols are either keys of variable_read (resolved per TC type and core library), "core_lib" or raw PLC symbol names
+DEFAULT_SNAPSHOT_SYMBOLS = "core_lib, man_auto, dis_horn, run"
+
+snapshot_view = {}  # Widgets and data of the snapshot window
+
+def resolve_snapshot_symbols(connection, tc_type, symbols):
+    core = detect_core_library(connection)
+    plc_names, known_values = {}, {}
+    for symbol in symbols:
+        if symbol == 'core_lib':
+            known_values[symbol] = core
+        elif symbol in variable_read:
+            plc_names[symbol] = variable_read[symbol]['TC2'] if tc_type == 'TC2' else variable_read[symbol][('TC3', core)]
+        else:
+            plc_names[symbol] = symbol
+    return plc_names, known_values
+
+def open_snapshot_window():
+    window = snapshot_view.get('window')
+    if window is not None and window.winfo_exists():
+        window.lift()
+        return
+
+    window = tk.Toplevel(root)
+    window.title("Fleet snapshot")
+
+    controls = ttk.Frame(window)
+    controls.pack(fill='x', padx=10, pady=10)
+    symbols_var = tk.StringVar(value=DEFAULT_SNAPSHOT_SYMBOLS)
+    ttk.Label(controls, text="Symbols").pack(side=tk.LEFT)
+    ttk.Entry(controls, textvariable=symbols_var, width=50).pack(side=tk.LEFT, padx=5)
+    take_button = ttk.Button(controls, text="Take snapshot", command=take_fleet_snapshot)
+    take_button.pack(side=tk.LEFT, padx=5)
+    ttk.Button(controls, text="Compare with...", command=compare_with_snapshot).pack(side=tk.LEFT)
+
+    status = ttk.Label(window, text="")
+    status.pack(fill='x', padx=10)
+
+    tree = ttk.Treeview(window, columns=("LGV",), show="headings", height=20)
+    tree.tag_configure('outlier', foreground='red')
+    tree.tag_configure('changed', foreground='orange')
+    tree.tag_configure('error', foreground='gray')
+    tree.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+    snapshot_view.clear()
+    snapshot_view.update(window=window, symbols_var=symbols_var, take_button=take_button, status=status, tree=tree, current=None, previous=None)
+
+def take_fleet_snapshot():
+    symbols = [symbol.strip() for symbol in snapshot_view['symbols_var'].get().split(",") if symbol.strip()]
+    lgvs = [tuple(treeview.item(row)["values"]) for row in treeview.get_children()]
+    if not symbols or not lgvs:
+        return
+    snapshot_view['take_button'].config(state="disabled")
+    snapshot_view['status'].config(text=f"Reading {len(symbols)} symbols from {len(lgvs)} LGVs...")
+    threading.Thread(target=background_snapshot, args=(lgvs, symbols, get_session_timeouts()), daemon=True).start()
+
+def background_snapshot(lgvs, symbols, timeouts):
+    connect_timeout, read_timeout = timeouts
+    snapshot = None
+    try:
+        snapshot = fleet_snapshot.take_snapshot(lgvs, symbols, resolve_snapshot_symbols,
+                                                connect_timeout=connect_timeout, read_timeout=read_timeout)
+        filename = fleet_snapshot.save_snapshot(snapshot)
+        log.info("Snapshot saved to %s", filename)
+    except Exception as e:
+        # e.g. a read-only install folder, the snapshot is still shown when it was taken
+        log.error("Snapshot failed: %s", e)
+    call_ui(on_snapshot_done, snapshot)
+
+def on_snapshot_done(snapshot):
+    if not snapshot_view['window'].winfo_exists():
+        return
+    snapshot_view['take_button'].config(state="normal")
+    if snapshot is None:
+        snapshot_view['status'].config(text="Snapshot failed, see the log")
+        return
+    snapshot_view['current'] = snapshot
+    show_snapshot()
+
+def compare_with_snapshot():
+    filename = filedialog.askopenfilename(title="Select earlier snapshot",
+                                          initialdir=fleet_snapshot.SNAPSHOT_DIR,
+                                          filetypes=[("Snapshot files", "*.json")],
+                                          parent=snapshot_view['window'])
+    if not filename:
+        return
+    try:
+        snapshot_view['previous'] = fleet_snapshot.load_snapshot(filename)
+    except Exception as e:
+        messagebox.showerror("Error", f"Could not load snapshot: {e}", parent=snapshot_view['window'])
+        return
+    # Without a fresh snapshot, show the loaded one
+    if snapshot_view['current'] is None:
+        snapshot_view['current'], snapshot_view['previous'] = snapshot_view['previous'], None
+    show_snapshot()
+
+def show_snapshot():
+    snapshot, previous = snapshot_view['current'], snapshot_view['previous']
+    tree = snapshot_view['tree']
+    symbols = snapshot['symbols']
+
+    tree.configure(columns=["LGV"] + symbols)
+    tree.heading("LGV", text="LGV", anchor='w')
+    tree.column("LGV", width=80, anchor='w')
+    for symbol in symbols:
+        tree.heading(symbol, text=symbol, anchor='w')
+        tree.column(symbol, width=120, anchor='w')
+    for row in tree.get_children():
+        tree.delete(row)
+
+    references, outliers = fleet_snapshot.find_outliers(snapshot)
+    changes = fleet_snapshot.compare_snapshots(previous, snapshot) if previous else {}
+
+    for lgv_name in sorted(snapshot['lgvs'], key=natural_keys):
+        entry = snapshot['lgvs'][lgv_name]
+        if entry['error']:
+            tree.insert("", "end", values=[lgv_name, entry['error']], tags=('error',))
+            continue
+        cells = []
+        for symbol in symbols:
+            if symbol in entry['values']:
+                text = str(entry['values'][symbol])
+                if (lgv_name, symbol) in outliers:
+                    text += f"  (fleet: {references[symbol]})"
+                if (lgv_name, symbol) in changes:
+                    text += f"  (was {changes[(lgv_name, symbol)]})"
+            else:
+                text = "read error" if symbol in entry['errors'] else ""
+            cells.append(text)
+        if any(lgv == lgv_name for lgv, _ in outliers):
+            tag = 'outlier'
+        elif any(lgv == lgv_name for lgv, _ in changes):
+            tag = 'changed'
+        else:
+            tag = ''
+        tree.insert("", "end", values=[lgv_name] + cells, tags=(tag,))
+
+    text = f"Snapshot {snapshot['taken_at']}: {len(snapshot['lgvs'])} LGVs, {len(outliers)} outlier values"
+    if previous:
+        text += f", {len(changes)} changes since {previous['taken_at']}"
+    snapshot_view['status'].config(text=text)
 
-    t = threading.Timer(0.1, update_buttons_from_plc_thread)
-    t.daemon = True 
-    t.start()
 
 ####################################################################################################################################################################
 ############################################################## Treeview setup and sorting ##########################################################################
@@ -711,6 +1309,33 @@ def natural_keys(text):
     return [int(c) if c.isdigit() else c for c in re.split(r'(\d+)', text)]
 
 
+####################################################################################################################################################################
+######################################################################## Log pane ##################################################################################
+####################################################################################################################################################################
+LOG_PANE_REFRESH_MS = 300
+LOG_PANE_MAX_LINES = 500
+
+log_pane_sequence = 0
+
+# Append the records logged since the last refresh, the pane is fed from the in-memory ring buffer only
+def refresh_log_pane():
+    global log_pane_sequence
+    log_pane_sequence, records = ads_log.ring_buffer.records_since(log_pane_sequence)
+    if records:
+        log_text.config(state="normal")
+        for levelno, text in records:
+            log_text.insert("end", text + "\n", logging.getLevelName(levelno))
+        excess = int(log_text.index("end-1c").split(".")[0]) - LOG_PANE_MAX_LINES
+        if excess > 0:
+            log_text.delete("1.0", f"{excess + 1}.0")
+        log_text.config(state="disabled")
+        log_text.see("end")
+    root.after(LOG_PANE_REFRESH_MS, refresh_log_pane)
+
+def on_log_level_change(event=None):
+    log.setLevel(log_level_var.get())
+
+
 ####################################################################################################################################################################
 ####################################################################### Create UI ##################################################################################
 ####################################################################################################################################################################
@@ -720,11 +1345,22 @@ def set_icon():
     if os.path.exists(icon_path):
         root.iconbitmap(icon_path)
     else:
-        print("Icon file not found.")
+        log.warning("Icon file not found.")
+
 
+# Run as the local ADS gateway instead of the GUI
+if "--gateway" in sys.argv:
+    sys.exit(ads_gateway.main())
+
+ads_log.setup_logging()
+log.info("Super ADS Client %s started", __version__)
 
 # Create the root window
 root = tk.Tk()
+
+# One event-loop thread for all ADS sessions, its results come back to Tk through the ui_calls queue
+engine = ads_engine.AdsEngine(dispatch=call_ui).start()
+root.after(UI_DRAIN_INTERVAL_MS, drain_ui_calls)
 root.title(f"Super ADS Client {__version__}")
 # root.geometry("600x400")  # Adjust the window size
 
@@ -785,6 +1421,16 @@ footer_frame = ttk.Frame(root)
 footer_frame.grid(row=0, column=0, sticky='nsw', padx=5, pady=5)
 load_config_button = ttk.Button(footer_frame, text="     Load \nconfig.db3", command=populate_table_from_db3)
 load_config_button.pack()
+check_all_button = ttk.Button(footer_frame, text="Check all", command=check_all_lgvs)
+check_all_button.pack(pady=(5, 0), fill='x')
+snapshot_button = ttk.Button(footer_frame, text="Snapshot", command=open_snapshot_window)
+snapshot_button.pack(pady=(5, 0), fill='x')
+discover_button = ttk.Button(footer_frame, text="Discover", command=discover_lgvs)
+discover_button.pack(pady=(5, 0), fill='x')
+routes_button = ttk.Button(footer_frame, text="Routes", command=provision_routes)
+routes_button.pack(pady=(5, 0), fill='x')
+sequences_button = ttk.Button(footer_frame, text="Sequences", command=open_sequence_window)
+sequences_button.pack(pady=(5, 0), fill='x')
 
 separator = ttk.Separator(root, orient='vertical')
 separator.grid(row=0, column=0, sticky='ns', pady=10)
@@ -804,6 +1450,16 @@ connect_button.grid(row=0, column=1, padx=5, ipady=4, sticky='e')
 core_status_label = ttk.Label(frame_connect, text="No Core Lib", foreground="#4682B4") # #3CB371, #6495ED, 4682B4
 core_status_label.grid(row=0, column=0, padx=0, pady=0)
 
+# Share one ADS session per LGV with other clients through the local gateway
+use_gateway = tk.BooleanVar(value=False)
+gateway_check = ttk.Checkbutton(frame_connect, text="Gateway", variable=use_gateway)
+gateway_check.grid(row=1, column=0, columnspan=2, padx=0, pady=0, sticky='e')
+
+# Start the handshake in the background on selection/hover, Connect then only adopts it
+preconnect_enabled = tk.BooleanVar(value=False)
+preconnect_check = ttk.Checkbutton(frame_connect, text="Pre-connect", variable=preconnect_enabled, command=on_preconnect_toggle)
+preconnect_check.grid(row=2, column=0, columnspan=2, padx=0, pady=0, sticky='e')
+
 
 
 # Connection status label
@@ -833,10 +1489,17 @@ treeview.column("Type", width=50, anchor='w')
 
 setup_treeview()
 
+# Row colours set by "Check all"
+treeview.tag_configure('online', foreground='green')
+treeview.tag_configure('reachable', foreground='orange')
+treeview.tag_configure('offline', foreground='gray')
+
 # Add the treeview to the table frame
 treeview.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
 treeview.bind("<<TreeviewSelect>>", on_treeview_select)
+treeview.bind("<Motion>", on_treeview_motion)
+treeview.bind("<Leave>", on_treeview_leave)
 
 # Create a vertical scrollbar for the table
 scrollbar = ttk.Scrollbar(table_frame, orient="vertical", command=treeview.yview)
@@ -846,6 +1509,18 @@ scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
 
 
+# Strict timeouts applied to the next connection
+timeout_frame = ttk.Frame(root)
+timeout_frame.grid(row=2, column=0, padx=10, pady=(0, 10), sticky='w')
+connect_timeout_var = tk.StringVar(value=str(ads_network.DEFAULT_CONNECT_TIMEOUT))
+read_timeout_var = tk.StringVar(value=str(ads_network.DEFAULT_READ_TIMEOUT))
+ttk.Label(timeout_frame, text="Connect timeout [s]").grid(row=0, column=0, padx=(0, 5))
+ttk.Spinbox(timeout_frame, from_=0.1, to=30.0, increment=0.5, width=5, textvariable=connect_timeout_var).grid(row=0, column=1, padx=(0, 15))
+ttk.Label(timeout_frame, text="Read timeout [s]").grid(row=0, column=2, padx=(0, 5))
+ttk.Spinbox(timeout_frame, from_=0.1, to=30.0, increment=0.5, width=5, textvariable=read_timeout_var).grid(row=0, column=3)
+
+
+
 # Create a frame for the buttons
 button_frame = ttk.Frame(root, width=170, height=350)
 button_frame.pack_propagate(False)
@@ -889,15 +1564,51 @@ dis_horn_button = ttk.Button(button_frame,
 dis_horn_button.pack(pady=5, fill='both', expand=True, ipady=3)
 
 
+# Log pane with level selection
+log_frame = ttk.Frame(root)
+log_frame.grid(row=3, column=0, columnspan=2, padx=10, pady=(0, 10), sticky='nsew')
+log_level_var = tk.StringVar(value=logging.getLevelName(log.level))
+log_level_box = ttk.Combobox(log_frame, textvariable=log_level_var, values=("DEBUG", "INFO", "WARNING", "ERROR"), state="readonly", width=10)
+log_level_box.pack(anchor='w')
+log_level_box.bind("<<ComboboxSelected>>", on_log_level_change)
+log_text = tk.Text(log_frame, height=6, width=60, state="disabled", font=("Consolas", 9), wrap="none")
+log_text.tag_configure("DEBUG", foreground="gray")
+log_text.tag_configure("WARNING", foreground="orange")
+log_text.tag_configure("ERROR", foreground="red")
+log_text.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+log_scrollbar = ttk.Scrollbar(log_frame, orient="vertical", command=log_text.yview)
+log_text.configure(yscrollcommand=log_scrollbar.set)
+log_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+refresh_log_pane()
+
+
 disable_control_buttons()
 # enable_control_buttons()
 
 load_table_data_from_xml(treeview)
 
+# Routes saved by "Routes" are not checked again
+try:
+    ads_routes.restore_local_routes(ads_routes.load_routes())
+except Exception as e:
+    log.warning("Could not load saved ADS routes: %s", e)
+
 
 def on_closing():
-    close_current_connection()  # Close connection before exiting
+    release_all_pulses()
+    cancel_preconnect()
+    closing = close_current_connection()  # Close connection before exiting
+    if closing is not None:
+        try:
+            closing.result(timeout=2)
+        except Exception:
+            pass
+    engine.stop()
     root.destroy()  # Close the application
+    ads_log.shutdown_logging()  # Flush the pending log records
+
+# Release the held buttons when the window loses focus
+root.bind("<FocusOut>", on_focus_out)
 
 # Bind the window close event to custom close function
 root.protocol("WM_DELETE_WINDOW", on_closing)
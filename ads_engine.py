@@ -0,0 +1,297 @@
+import asyncio
+import ctypes
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pyads
+
+import ads_network
+from ads_log import log
+
+# asyncio ADS engine.
+#
+# One event loop on a background thread drives any number of AdsSessions. The
+# blocking pyads calls run on a small shared pool of I/O threads, so dozens of
+# LGVs can be polled with a handful of threads instead of a timer thread per
+# tick. Every call has a per-session timeout and can be cancelled. Results are
+# handed to the GUI through the dispatch function (root.after on the Tk side).
+
+DEFAULT_IO_THREADS = 8
+TIMEOUT_GRACE = 0.5     # seconds added to the ADS timeout before the engine gives up on a call
+
+# Polling of the button lamps, and a PLC state check every STATE_CHECK_EVERY polls
+POLL_INTERVAL = 0.1
+STATE_CHECK_EVERY = 10
+
+
+class AdsEngine:
+    def __init__(self, io_threads=DEFAULT_IO_THREADS, dispatch=None):
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix="ads-io")
+        self.loop.set_default_executor(self.executor)
+        self.dispatch = dispatch
+        self.thread = threading.Thread(target=self._run, name="ads-engine", daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self, timeout=2.0):
+        if not self.thread.is_alive():
+            return
+
+        async def cancel_tasks():
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        try:
+            self.submit(cancel_tasks()).result(timeout)
+        except Exception as e:
+            log.warning("Engine tasks did not stop cleanly: %s", e)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, coro, on_done=None):
+        """
+        Schedule coro on the engine loop from any thread, returns a concurrent.futures.Future.
+        on_done(future) runs through dispatch (on the UI thread) when one is set.
+        """
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        if on_done is not None:
+            future.add_done_callback(lambda done: self.call_ui(on_done, done))
+        return future
+
+    # Blocking helper for scripts and headless callers
+    def run(self, coro, timeout=None):
+        return self.submit(coro).result(timeout)
+
+    def call_ui(self, fn, *args):
+        if self.dispatch is None:
+            fn(*args)
+        else:
+            self.dispatch(fn, *args)
+
+    # Cancel a task started on the loop, from any thread
+    def cancel(self, task):
+        if task is not None:
+            self.loop.call_soon_threadsafe(task.cancel)
+
+
+async def run_periodic(interval, step):
+    """
+    Await step() every interval seconds on the loop clock, without drift. Ticks missed
+    because a step took too long are skipped rather than run back to back.
+    """
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    next_time = loop.time()
+    while True:
+        await step()
+        # wait_for before Python 3.12 swallows a cancel that arrives just as its call completes,
+        # the task would then poll on forever
+        if getattr(task, 'cancelling', lambda: 0)():
+            raise asyncio.CancelledError()
+        next_time += interval
+        delay = next_time - loop.time()
+        if delay < 0:
+            next_time = loop.time()
+            delay = 0
+        await asyncio.sleep(delay)
+
+
+async def check_running(session):
+    if (await session.read_state())[0] != pyads.ADSSTATE_RUN:
+        raise Exception("PLC not in a valid state")
+
+async def poll_values(session, read_names, on_values, interval=POLL_INTERVAL, state_check_every=STATE_CHECK_EVERY):
+    """
+    Sum-read read_names ({key: symbol}) every interval seconds and call on_values({key: value}) on the loop,
+    the value is None for a symbol that could not be read. Raises once the PLC stops answering or running.
+    """
+    tick = 0
+
+    async def step():
+        nonlocal tick
+        if tick % state_check_every == 0:
+            await check_running(session)
+        tick += 1
+
+        try:
+            # One sum-read for all symbols
+            values = await session.read_list(read_names.values())
+        except asyncio.TimeoutError:
+            raise
+        except Exception as e:
+            log.error("Error reading variables %s: %s", ", ".join(read_names.values()), e, extra={'symbol': "poll"})
+            return
+        result = {}
+        for key, name in read_names.items():
+            value = values.get(name)
+            # A failed symbol of a sum-read comes back as pyads' error text instead of a value
+            if not isinstance(value, bool):
+                log.error("Error reading variable %s: %s", name, value, extra={'symbol': name})
+                value = None
+            result[key] = value
+        on_values(result)
+
+    await run_periodic(interval, step)
+
+
+def _close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+class AdsSession:
+    """
+    Awaitable ADS operations on one target. Calls on a session are serialized, calls on
+    different sessions run concurrently on the engine's I/O threads.
+    open_connection(ams_net_id, ads_port, read_timeout) returns an opened connection,
+    a direct pyads one by default. open_timeout caps the open, connect_timeout + read_timeout by default.
+    """
+    def __init__(self, engine, ams_net_id, ads_port, connect_timeout=ads_network.DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout=ads_network.DEFAULT_READ_TIMEOUT, open_connection=None, open_timeout=None):
+        self.engine = engine
+        self.ams_net_id = ams_net_id
+        self.ads_port = ads_port
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.open_connection = open_connection or ads_network.open_connection
+        self.open_timeout = open_timeout or connect_timeout + read_timeout
+        self.connection = None
+        self._lock = asyncio.Lock()
+        self._notifications = []
+        self._handles = {}
+        self._handle_locks = {}
+
+    @property
+    def is_open(self):
+        return self.connection is not None
+
+    async def connect(self):
+        loop = asyncio.get_running_loop()
+        # Fail fast when the target is switched off
+        await asyncio.wait_for(loop.run_in_executor(self.engine.executor, ads_network.check_reachable, self.ams_net_id, self.connect_timeout),
+                               self.connect_timeout + TIMEOUT_GRACE)
+
+        opening = loop.run_in_executor(self.engine.executor, self.open_connection, self.ams_net_id, self.ads_port, self.read_timeout)
+        try:
+            self.connection = await asyncio.wait_for(asyncio.shield(opening), self.open_timeout + TIMEOUT_GRACE)
+        except (asyncio.CancelledError, asyncio.TimeoutError) as e:
+            # The open keeps running on its I/O thread, close whatever it returns
+            opening.add_done_callback(lambda done: done.cancelled() or done.exception() or _close_quietly(done.result()))
+            if isinstance(e, asyncio.TimeoutError):
+                raise asyncio.TimeoutError(f"open timed out after {self.open_timeout:.1f} s") from None
+            raise
+        return self
+
+    # Wrap a connection opened elsewhere (e.g. a pre-connect)
+    def adopt(self, connection):
+        self.connection = connection
+        return self
+
+    async def call(self, fn, *args, timeout=None):
+        """
+        Run fn(connection, *args) on an I/O thread
+        """
+        if self.connection is None:
+            raise ConnectionError(f"{self.ams_net_id}: session not connected")
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            return await asyncio.wait_for(loop.run_in_executor(self.engine.executor, fn, self.connection, *args),
+                                          timeout or self.read_timeout + TIMEOUT_GRACE)
+
+    async def read_state(self):
+        return await self.call(lambda connection: connection.read_state())
+
+    async def read(self, data_name, plc_datatype):
+        return await self.call(lambda connection: connection.read_by_name(data_name, plc_datatype))
+
+    # Sum-read, one round trip for all names
+    async def read_list(self, data_names):
+        data_names = list(data_names)
+        return await self.call(lambda connection: connection.read_list_by_name(data_names))
+
+    async def write(self, data_name, value, plc_datatype):
+        return await self.call(lambda connection: connection.write_by_name(data_name, value, plc_datatype))
+
+    # Sum-write, one round trip for all values
+    async def write_list(self, values):
+        values = dict(values)
+        return await self.call(lambda connection: connection.write_list_by_name(values))
+
+    async def get_handle(self, data_name):
+        """
+        Symbol handle of data_name, created once per session. None if the connection has no
+        handles (gateway), the by-name calls are used then.
+        """
+        if not hasattr(self.connection, 'get_handle'):
+            return None
+        # A sequence and a button on the same symbol must not both create a handle, one would never be released
+        async with self._handle_locks.setdefault(data_name, asyncio.Lock()):
+            if data_name not in self._handles:
+                self._handles[data_name] = await self.call(lambda connection: connection.get_handle(data_name))
+        return self._handles[data_name]
+
+    async def read_by_handle(self, data_name, plc_datatype):
+        handle = await self.get_handle(data_name)
+        if handle is None:
+            return await self.read(data_name, plc_datatype)
+        return await self.call(lambda connection: connection.read_by_name("", plc_datatype, handle=handle))
+
+    async def write_by_handle(self, data_name, value, plc_datatype):
+        handle = await self.get_handle(data_name)
+        if handle is None:
+            return await self.write(data_name, value, plc_datatype)
+        return await self.call(lambda connection: connection.write_by_name("", value, plc_datatype, handle=handle))
+
+    async def add_notification(self, data_name, plc_datatype, callback, cycle_time_ms=100):
+        """
+        Call callback(data_name, value) on the engine loop whenever the PLC value changes
+        """
+        loop = asyncio.get_running_loop()
+
+        def on_change(handle, name, timestamp, value):
+            loop.call_soon_threadsafe(callback, data_name, value)
+
+        attrib = pyads.NotificationAttrib(ctypes.sizeof(plc_datatype), max_delay=cycle_time_ms, cycle_time=cycle_time_ms)
+        handles = await self.call(lambda connection: connection.add_device_notification(
+            data_name, attrib, connection.notification(plc_datatype)(on_change)))
+        self._notifications.append(handles)
+        return handles
+
+    async def close(self):
+        connection, self.connection = self.connection, None
+        if connection is None:
+            return
+        notifications, self._notifications = self._notifications, []
+        handles, self._handles = list(self._handles.values()), {}
+        self._handle_locks = {}
+
+        def close_connection():
+            for notification in notifications:
+                try:
+                    connection.del_device_notification(*notification)
+                except Exception:
+                    pass
+            for handle in handles:
+                try:
+                    connection.release_handle(handle)
+                except Exception:
+                    pass
+            _close_quietly(connection)
+
+        loop = asyncio.get_running_loop()
+        try:
+            await asyncio.wait_for(loop.run_in_executor(self.engine.executor, close_connection), self.read_timeout + TIMEOUT_GRACE)
+        except asyncio.TimeoutError:
+            log.warning("%s: close timed out", self.ams_net_id)
@@ -0,0 +1,496 @@
+import json
+import queue
+import socket
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+
+import pyads
+
+import ads_log
+import ads_network
+from ads_log import log
+
+# Local ADS gateway.
+#
+# Holds a single pyads connection per LGV and shares it with any number of
+# Super ADS Client instances over a local socket. Every client subscribes to the
+# symbols it polls, the gateway merges them into one sum-read per poll cycle and
+# pushes the changed values back. Writes are queued on the LGV's I/O thread, so
+# they reach the PLC in the order they were sent.
+#
+# Start it with "SuperADSClient.exe --gateway" (or "python ads_gateway.py").
+# The wire format is one JSON object per line:
+#   request  -> {"id": 1, "op": "write", "name": "...", "value": true, "type": "BOOL"}
+#   response <- {"id": 1, "ok": true, "result": null}
+#   event    <- {"event": "values", "values": {"...": true}}
+#   event    <- {"event": "invalid", "symbols": ["..."]}     the symbols could not be read, drop their values
+
+GATEWAY_HOST = "127.0.0.1"
+GATEWAY_PORT = 48950
+
+POLL_INTERVAL = 0.1         # Merged sum-read of all subscribed symbols
+STATE_INTERVAL = 1.0        # read_state() published to every client
+REQUEST_TIMEOUT = 5.0       # Client side wait for a gateway response
+START_TIMEOUT = 3.0         # Wait for a freshly started gateway process to listen
+STATE_STALE_AFTER = 3.0     # Cached state older than this is read again
+
+# PLC types travel by name over the socket
+plc_types = {
+    'BOOL': pyads.PLCTYPE_BOOL,
+    'BYTE': pyads.PLCTYPE_BYTE,
+    'SINT': pyads.PLCTYPE_SINT,
+    'INT': pyads.PLCTYPE_INT,
+    'DINT': pyads.PLCTYPE_DINT,
+    'UINT': pyads.PLCTYPE_UINT,
+    'UDINT': pyads.PLCTYPE_UDINT,
+    'WORD': pyads.PLCTYPE_WORD,
+    'DWORD': pyads.PLCTYPE_DWORD,
+    'REAL': pyads.PLCTYPE_REAL,
+    'LREAL': pyads.PLCTYPE_LREAL,
+}
+plc_type_names = {plc_type: name for name, plc_type in reversed(list(plc_types.items()))}
+
+
+class GatewayError(Exception):
+    pass
+
+
+####################################################################################################################################################################
+################################################################### Gateway (server side) ##########################################################################
+####################################################################################################################################################################
+
+class LGVSession:
+    """
+    One ADS connection to one LGV, owned by a single I/O thread
+    """
+    def __init__(self, net_id, port):
+        self.net_id = net_id
+        self.port = port
+        self.clients = {}           # client handler -> set of subscribed symbols
+        self.values = {}            # last polled value of every subscribed symbol
+        self.state = None
+        self.error = None
+        self.jobs = queue.Queue()
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.connection = None
+        self.thread = threading.Thread(target=self._run, name=f"gateway-{net_id}", daemon=True)
+        self.thread.start()
+
+    # Run fn(connection) on the I/O thread and wait for the result
+    def call(self, fn, timeout=REQUEST_TIMEOUT):
+        done = threading.Event()
+        outcome = {}
+        self.jobs.put((fn, done, outcome))
+        if not done.wait(timeout):
+            raise GatewayError(f"{self.net_id}: request timed out")
+        if 'error' in outcome:
+            raise outcome['error']
+        return outcome['result']
+
+    def subscribe(self, client, symbols):
+        with self.lock:
+            self.clients.setdefault(client, set()).update(symbols)
+            known = {name: self.values[name] for name in symbols if name in self.values}
+        if known:
+            client.send_event({"event": "values", "values": known})
+
+    def add_client(self, client):
+        with self.lock:
+            self.clients.setdefault(client, set())
+
+    def remove_client(self, client):
+        with self.lock:
+            self.clients.pop(client, None)
+            return len(self.clients)
+
+    def stop(self):
+        self.stop_event.set()
+        self.jobs.put(None)
+
+    def _open(self):
+        if self.connection is None:
+            connection = pyads.Connection(self.net_id, self.port)
+            connection.open()
+            self.connection = connection
+        return self.connection
+
+    def _drop(self, error):
+        log.warning("%s: session lost: %s", self.net_id, error, extra={'symbol': f"gateway:{self.net_id}"})
+        self.error = str(error)
+        self.state = None
+        self.values.clear()
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+        self._publish({"event": "error", "error": self.error})
+
+    def _publish(self, message, symbols=None):
+        with self.lock:
+            clients = list(self.clients.items())
+        for client, subscribed in clients:
+            if symbols is None:
+                client.send_event(message)
+                continue
+            values = {name: message["values"][name] for name in subscribed & symbols}
+            if values:
+                client.send_event({"event": "values", "values": values})
+
+    def _poll_values(self):
+        with self.lock:
+            symbols = set().union(*self.clients.values()) if self.clients else set()
+        if not symbols:
+            return
+        values = self._open().read_list_by_name(sorted(symbols))
+        # A symbol that failed in the sum-read comes back as pyads' error text, never serve that as its value
+        failed = {name for name, value in values.items() if ads_network.is_sum_read_error(value)}
+        if failed:
+            for name in failed:
+                log.warning("%s: error reading %s: %s", self.net_id, name, values.pop(name), extra={'symbol': f"gateway:{name}"})
+                self.values.pop(name, None)
+            with self.lock:
+                clients = list(self.clients.items())
+            for client, subscribed in clients:
+                if subscribed & failed:
+                    client.send_event({"event": "invalid", "symbols": sorted(subscribed & failed)})
+        changed = {name: value for name, value in values.items() if self.values.get(name) != value or name not in self.values}
+        self.values.update(values)
+        if changed:
+            self._publish({"event": "values", "values": changed}, set(changed))
+
+    def _poll_state(self):
+        state = list(self._open().read_state())
+        self.state = state
+        self.error = None
+        self._publish({"event": "state", "state": state})
+
+    def _run(self):
+        next_poll = next_state = time.monotonic()
+        while not self.stop_event.is_set():
+            try:
+                job = self.jobs.get(timeout=max(0.0, min(next_poll, next_state) - time.monotonic()))
+            except queue.Empty:
+                job = None
+
+            if job is not None:
+                fn, done, outcome = job
+                try:
+                    outcome['result'] = fn(self._open())
+                except Exception as e:
+                    outcome['error'] = e
+                finally:
+                    done.set()
+                continue
+
+            if self.stop_event.is_set():
+                break
+
+            now = time.monotonic()
+            try:
+                if now >= next_state:
+                    next_state = now + STATE_INTERVAL
+                    self._poll_state()
+                if now >= next_poll:
+                    next_poll = now + POLL_INTERVAL
+                    self._poll_values()
+            except Exception as e:
+                self._drop(e)
+                next_poll = next_state = time.monotonic() + STATE_INTERVAL
+
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+
+sessions = {}
+sessions_lock = threading.Lock()
+
+# The client is added under sessions_lock, so a release of the last client in between
+# cannot stop the session it is handed
+def get_session(net_id, port, client):
+    with sessions_lock:
+        key = (net_id, port)
+        if key not in sessions:
+            sessions[key] = LGVSession(net_id, port)
+        session = sessions[key]
+        session.add_client(client)
+        return session
+
+def release_session(session, client):
+    with sessions_lock:
+        if session.remove_client(client) == 0:
+            # A newer session for the same LGV may have taken the key
+            if sessions.get((session.net_id, session.port)) is session:
+                del sessions[(session.net_id, session.port)]
+            session.stop()
+
+
+class GatewayClientHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.send_lock = threading.Lock()
+        self.session = None
+
+    def send_event(self, message):
+        try:
+            data = (json.dumps(message) + "\n").encode('utf-8')
+            with self.send_lock:
+                self.wfile.write(data)
+                self.wfile.flush()
+        except OSError:
+            pass
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            request = None
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise GatewayError("Malformed request")
+                result = self.dispatch(request)
+                self.send_event({"id": request.get('id'), "ok": True, "result": result})
+            except Exception as e:
+                # A malformed line gets an error response too, the client keeps its connection
+                request_id = request.get('id') if isinstance(request, dict) else None
+                self.send_event({"id": request_id, "ok": False, "error": str(e)})
+            if isinstance(request, dict) and request.get('op') == 'close':
+                break
+
+    def finish(self):
+        if self.session is not None:
+            release_session(self.session, self)
+            self.session = None
+        super().finish()
+
+    def dispatch(self, request):
+        op = request.get('op')
+        if op == 'open':
+            if self.session is not None:
+                raise GatewayError("Session already open")
+            session = get_session(request['net_id'], int(request['port']), self)
+            self.session = session
+            try:
+                # Make sure the LGV is reachable before reporting success
+                return list(session.call(lambda conn: conn.read_state()))
+            except Exception:
+                release_session(session, self)
+                self.session = None
+                raise
+
+        if self.session is None:
+            raise GatewayError("No session open")
+
+        if op == 'close':
+            release_session(self.session, self)
+            self.session = None
+            return None
+        if op == 'subscribe':
+            self.session.subscribe(self, set(request['symbols']))
+            return None
+        if op == 'read_state':
+            return list(self.session.call(lambda conn: conn.read_state()))
+        if op == 'read':
+            name, plc_type = request['name'], plc_types[request['type']]
+            return self.session.call(lambda conn: conn.read_by_name(name, plc_type))
+        if op == 'write':
+            name, value, plc_type = request['name'], request['value'], plc_types[request['type']]
+            return self.session.call(lambda conn: conn.write_by_name(name, value, plc_type))
+        raise GatewayError(f"Unknown operation '{op}'")
+
+
+class GatewayServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def serve(host=GATEWAY_HOST, port=GATEWAY_PORT):
+    with GatewayServer((host, port), GatewayClientHandler) as server:
+        log.info("ADS gateway listening on %s:%s", host, port)
+        server.serve_forever()
+
+def main():
+    ads_log.setup_logging("ADSGateway.log")
+    try:
+        serve()
+    finally:
+        ads_log.shutdown_logging()
+    return 0
+
+
+####################################################################################################################################################################
+################################################################### Client side connection #########################################################################
+####################################################################################################################################################################
+
+class GatewayConnection:
+    """
+    Drop-in replacement for the subset of pyads.Connection used by the client.
+    Polled symbols are served from the values pushed by the gateway.
+    """
+    def __init__(self, ams_net_id, ams_net_port, host=GATEWAY_HOST, port=GATEWAY_PORT, timeout=REQUEST_TIMEOUT):
+        self.ams_net_id = ams_net_id
+        self.ams_net_port = ams_net_port
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = None
+        self.is_open = False
+        self._next_id = 0
+        self._pending = {}
+        self._values = {}
+        self._subscribed = set()
+        self._state = None
+        self._state_time = 0.0
+        self._error = None
+        self._lock = threading.Lock()
+        self._reader = None
+
+    def open(self):
+        self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self.sock.settimeout(None)
+        self._reader = threading.Thread(target=self._read_loop, name="gateway-client", daemon=True)
+        self._reader.start()
+        try:
+            self._set_state(self._request('open', net_id=self.ams_net_id, port=self.ams_net_port))
+        except Exception:
+            self.close()
+            raise
+        self.is_open = True
+
+    def close(self):
+        if self.sock is None:
+            return
+        try:
+            if self.is_open:
+                self._request('close')
+        except Exception:
+            pass
+        self.is_open = False
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        self.sock = None
+
+    def read_state(self):
+        if self._error:
+            raise GatewayError(self._error)
+        if self._state is None or time.monotonic() - self._state_time > STATE_STALE_AFTER:
+            self._set_state(self._request('read_state'))
+        return tuple(self._state)
+
+    def read_by_name(self, data_name, plc_datatype):
+        if data_name in self._values:
+            return self._values[data_name]
+        value = self._request('read', name=data_name, type=plc_type_names[plc_datatype])
+        # Only subscribe once the symbol is known to exist, an unknown name would break the merged sum-read
+        if data_name not in self._subscribed:
+            self._subscribed.add(data_name)
+            self._request('subscribe', symbols=[data_name])
+        self._values.setdefault(data_name, value)
+        return value
+
+    # Only BOOL symbols are polled by the client
+    def read_list_by_name(self, data_names):
+        return {data_name: self.read_by_name(data_name, pyads.PLCTYPE_BOOL) for data_name in data_names}
+
+    def write_by_name(self, data_name, value, plc_datatype):
+        self._request('write', name=data_name, value=value, type=plc_type_names[plc_datatype])
+
+    def _set_state(self, state):
+        self._state = state
+        self._state_time = time.monotonic()
+
+    def _request(self, op, **params):
+        if self.sock is None:
+            raise GatewayError("Gateway connection closed")
+        with self._lock:
+            self._next_id += 1
+            request_id = self._next_id
+            waiter = {'event': threading.Event()}
+            self._pending[request_id] = waiter
+        data = (json.dumps(dict(params, id=request_id, op=op)) + "\n").encode('utf-8')
+        try:
+            self.sock.sendall(data)
+            if not waiter['event'].wait(self.timeout):
+                raise GatewayError(f"Gateway request '{op}' timed out")
+        finally:
+            with self._lock:
+                self._pending.pop(request_id, None)
+        response = waiter.get('response')
+        if response is None:
+            raise GatewayError("Gateway connection lost")
+        if not response.get('ok'):
+            raise GatewayError(response.get('error'))
+        return response.get('result')
+
+    def _read_loop(self):
+        try:
+            for line in self.sock.makefile('rb'):
+                message = json.loads(line)
+                event = message.get('event')
+                if event == 'values':
+                    self._values.update(message['values'])
+                elif event == 'invalid':
+                    # The next read goes to the PLC and reports the error
+                    for name in message['symbols']:
+                        self._values.pop(name, None)
+                elif event == 'state':
+                    self._error = None
+                    self._set_state(message['state'])
+                elif event == 'error':
+                    self._error = message['error']
+                    self._values.clear()
+                else:
+                    with self._lock:
+                        waiter = self._pending.get(message.get('id'))
+                    if waiter is not None:
+                        waiter['response'] = message
+                        waiter['event'].set()
+        except (OSError, ValueError):
+            pass
+        finally:
+            self._error = self._error or "Gateway connection lost"
+            with self._lock:
+                waiters = list(self._pending.values())
+            for waiter in waiters:
+                waiter['event'].set()
+
+
+def is_gateway_running(host=GATEWAY_HOST, port=GATEWAY_PORT):
+    try:
+        with socket.create_connection((host, port), timeout=0.5):
+            return True
+    except OSError:
+        return False
+
+# Start the gateway as a detached process, from the frozen exe or from source
+def start_gateway_process(wait=START_TIMEOUT):
+    if getattr(sys, 'frozen', False):
+        command = [sys.executable, "--gateway"]
+    else:
+        command = [sys.executable, __file__]
+    flags = getattr(subprocess, 'CREATE_NO_WINDOW', 0)
+    subprocess.Popen(command, creationflags=flags, close_fds=True)
+
+    deadline = time.monotonic() + wait
+    while time.monotonic() < deadline:
+        if is_gateway_running():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+import collections
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+# Structured, non-blocking logging.
+#
+# Callers only put records on an in-memory queue (QueueHandler), so the 100 ms
+# poll path never waits on disk. A QueueListener thread writes them to a
+# rotating file and to a bounded ring buffer that the GUI shows in its log pane.
+# Repeated errors for the same symbol are rate-limited before they are queued.
+
+LOGGER_NAME = "SuperADSClient"
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(threadName)s: %(message)s"
+DEFAULT_LOG_FILE = "SuperADSClient.log"
+RING_BUFFER_SIZE = 1000
+RATE_LIMIT_INTERVAL = 10.0  # seconds between two records with the same key
+
+log = logging.getLogger(LOGGER_NAME)
+
+
+class RingBufferHandler(logging.Handler):
+    """
+    Keeps the last records in memory, numbered so a reader can fetch only the new ones
+    """
+    def __init__(self, capacity=RING_BUFFER_SIZE):
+        super().__init__()
+        self.records = collections.deque(maxlen=capacity)
+        self.sequence = 0
+        self.buffer_lock = threading.Lock()
+
+    def emit(self, record):
+        with self.buffer_lock:
+            self.sequence += 1
+            self.records.append((self.sequence, record.levelno, self.format(record)))
+
+    # Returns (last sequence, [(levelno, text), ...]) of the records after sequence
+    def records_since(self, sequence):
+        with self.buffer_lock:
+            new = [(levelno, text) for number, levelno, text in self.records if number > sequence]
+            return self.sequence, new
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets one record per symbol through every interval, the symbol being the record's "symbol" extra.
+    The next record let through reports how many were dropped. Only records at or above min_level
+    that carry a symbol are limited, per-LGV results and one-off errors always get through.
+    """
+    def __init__(self, interval=RATE_LIMIT_INTERVAL, min_level=logging.WARNING):
+        super().__init__()
+        self.interval = interval
+        self.min_level = min_level
+        self.last_emit = {}
+        self.suppressed = collections.Counter()
+        self.filter_lock = threading.Lock()
+
+    def filter(self, record):
+        symbol = getattr(record, 'symbol', None)
+        if record.levelno < self.min_level or symbol is None:
+            return True
+        key = (record.levelno, symbol)
+        now = time.monotonic()
+        with self.filter_lock:
+            if now - self.last_emit.get(key, -self.interval) < self.interval:
+                self.suppressed[key] += 1
+                return False
+            self.last_emit[key] = now
+            dropped = self.suppressed.pop(key, 0)
+        if dropped:
+            record.msg = f"{record.msg} ({dropped} similar suppressed)"
+        return True
+
+
+ring_buffer = RingBufferHandler()
+queue_listener = None
+
+def setup_logging(filename=DEFAULT_LOG_FILE, level=logging.INFO):
+    global queue_listener
+    if queue_listener is not None:
+        return log
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [ring_buffer]
+    ring_buffer.setFormatter(formatter)
+    try:
+        file_handler = logging.handlers.RotatingFileHandler(filename, maxBytes=1_000_000, backupCount=3, encoding='utf-8')
+        file_handler.setFormatter(formatter)
+        handlers.append(file_handler)
+    except OSError:
+        # Read-only install folder, keep the in-memory log only
+        pass
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter())
+    log.addHandler(queue_handler)
+    log.setLevel(level)
+    log.propagate = False
+
+    queue_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    queue_listener.start()
+    return log
+
+def shutdown_logging():
+    global queue_listener
+    if queue_listener is not None:
+        queue_listener.stop()
+        queue_listener = None
@@ -0,0 +1,96 @@
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pyads
+from pyads.errorcodes import ERROR_CODES
+
+# Reachability checks and strict timeouts for ADS targets.
+#
+# pyads waits for the router's default timeout (several seconds) when a vehicle
+# is switched off. These helpers fail fast with a plain TCP check of the AMS
+# port first, and set a short ADS timeout on every connection they open.
+
+AMS_TCP_PORT = 48898
+
+DEFAULT_CONNECT_TIMEOUT = 1.0   # seconds, TCP reachability of the AMS port
+DEFAULT_READ_TIMEOUT = 1.0      # seconds, applied to every ADS request of a connection
+DEFAULT_MAX_WORKERS = 16
+
+# pyads puts the error text in place of the value of a symbol that failed in a sum-read
+SUM_READ_ERRORS = frozenset(ERROR_CODES.values())
+
+
+class UnreachableError(Exception):
+    pass
+
+
+def ip_from_net_id(ams_net_id):
+    # LGV net ids are "<ip>.1.1"
+    return ".".join(ams_net_id.split(".")[:4])
+
+def ads_port_for(tc_type):
+    return 851 if tc_type == 'TC3' else 801
+
+def is_sum_read_error(value):
+    return isinstance(value, str) and value in SUM_READ_ERRORS
+
+
+def is_reachable(ip_address, port=AMS_TCP_PORT, timeout=DEFAULT_CONNECT_TIMEOUT):
+    try:
+        with socket.create_connection((ip_address, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+def check_reachable(ams_net_id, timeout=DEFAULT_CONNECT_TIMEOUT, port=AMS_TCP_PORT):
+    ip_address = ip_from_net_id(ams_net_id)
+    if not is_reachable(ip_address, port, timeout):
+        raise UnreachableError(f"{ip_address} not reachable on port {port}")
+
+
+# Open a pyads connection with a strict timeout for every ADS request
+def open_connection(ams_net_id, ads_port, read_timeout=DEFAULT_READ_TIMEOUT):
+    connection = pyads.Connection(ams_net_id, ads_port)
+    connection.open()
+    try:
+        connection.set_timeout(int(read_timeout * 1000))
+    except Exception:
+        connection.close()
+        raise
+    return connection
+
+
+def probe_target(ams_net_id, ads_port, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT):
+    """
+    Pre-flight check of one target: TCP reachability of the AMS port, then read_state with a short ADS timeout.
+    Returns a dict with net_id, port, reachable, state (ADS state or None), error and elapsed seconds.
+    """
+    result = {'net_id': ams_net_id, 'port': ads_port, 'reachable': False, 'state': None, 'error': None}
+    start = time.perf_counter()
+    connection = None
+    try:
+        check_reachable(ams_net_id, connect_timeout)
+        result['reachable'] = True
+        connection = open_connection(ams_net_id, ads_port, read_timeout)
+        result['state'] = connection.read_state()[0]
+    except Exception as e:
+        result['error'] = str(e)
+    finally:
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+        result['elapsed'] = time.perf_counter() - start
+    return result
+
+def probe_targets(targets, max_workers=DEFAULT_MAX_WORKERS, connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT):
+    """
+    Probe many (ams_net_id, ads_port) targets at once. Results are returned in the order of targets.
+    """
+    targets = list(targets)
+    if not targets:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(targets))) as executor:
+        return list(executor.map(lambda target: probe_target(target[0], target[1], connect_timeout, read_timeout), targets))
@@ -0,0 +1,151 @@
+import asyncio
+
+import pyads
+from pyads.errorcodes import ERROR_CODES
+
+from ads_log import log
+
+# Pulse writes with a guaranteed release.
+#
+# A pulse sets one or more command bits and always writes the release value,
+# whatever happens in between: cancellation, a failed write or a lost GUI
+# release event. Both halves run on the ADS engine, the press and the release of
+# several bits each go out as one sum-write. pyads sum-writes are keyed by symbol
+# name, so the press and the release of the same bit always take two requests
+# (a PLC task would not see a bit set and cleared within one request anyway);
+# the release is queued right behind the press on the same session instead.
+#
+# HeldPulse is the hold-to-run variant for the control buttons: the release is
+# written when the GUI asks for it, or by the watchdog after max_hold at the
+# latest. Every pulse is timed and reported.
+
+DEFAULT_MAX_HOLD = 3.0      # seconds a hold-to-run bit may stay set without a release from the GUI
+RELEASE_ATTEMPTS = 3
+RELEASE_RETRY_DELAY = 0.1   # seconds before the second attempt, doubled after every failure
+NO_ERROR = ERROR_CODES[0]
+
+
+async def write_values(session, values):
+    """
+    Write {name: bool}, one sum-write for several names when the connection supports it
+    """
+    if len(values) > 1 and hasattr(session.connection, 'write_list_by_name'):
+        # pyads reports the outcome of every symbol instead of raising
+        result = await session.write_list(values)
+        failed = [f"{name}: {code}" for name, code in result.items() if code != NO_ERROR]
+        if failed:
+            raise Exception("Sum-write failed for " + ", ".join(failed))
+    else:
+        for name, value in values.items():
+            await session.write_by_handle(name, value, pyads.PLCTYPE_BOOL)
+
+async def write_release(session, values, attempts=RELEASE_ATTEMPTS, retry_delay=RELEASE_RETRY_DELAY):
+    """
+    Write the release values, retrying so a single failed request does not leave a bit set
+    """
+    names = ", ".join(values)
+    delay = retry_delay
+    for attempt in range(1, attempts + 1):
+        try:
+            await write_values(session, values)
+            return
+        except Exception as e:
+            # Without a connection the retries cannot reach the PLC either
+            if attempt == attempts or session.connection is None:
+                log.error("Release of %s failed (attempt %d), the bit may still be set on the PLC: %s", names, attempt, e,
+                          extra={'symbol': names})
+                raise
+            log.warning("Release of %s failed (attempt %d), retrying in %.0f ms: %s", names, attempt, delay * 1000, e,
+                        extra={'symbol': names})
+        await asyncio.sleep(delay)
+        delay *= 2
+
+async def pulse(session, press_values, hold):
+    """
+    Write press_values ({name: press value}), hold for hold seconds from the moment the press was sent,
+    then write the inverted values. Returns the timing report (seconds): press, hold, release.
+    """
+    loop = asyncio.get_running_loop()
+    release_values = {name: not value for name, value in press_values.items()}
+    report = {'press': None, 'hold': None, 'release': None}
+    start = loop.time()
+    try:
+        await write_values(session, press_values)
+        pressed = loop.time()
+        report['press'] = pressed - start
+        await asyncio.sleep(max(0.0, start + hold - pressed))
+    finally:
+        # Also after a failed press, the bit may have been set before the response was lost
+        released = loop.time()
+        report['hold'] = released - start
+        await asyncio.shield(write_release(session, release_values))
+        report['release'] = loop.time() - released
+    return report
+
+
+class HeldPulse:
+    """
+    Hold-to-run pulse on one bit. Created from the GUI thread, runs on the engine loop.
+    on_pressed(ok) runs once the press was written (or failed), on_done(report) after the release,
+    both through the engine's dispatch.
+    """
+    def __init__(self, engine, session, data_name, press_value=True, max_hold=DEFAULT_MAX_HOLD, on_pressed=None, on_done=None):
+        self.engine = engine
+        self.session = session
+        self.data_name = data_name
+        self.press_value = press_value
+        self.max_hold = max_hold
+        self.on_pressed = on_pressed
+        self.on_done = on_done
+        self.report = {'name': data_name, 'press': None, 'hold': None, 'release': None, 'watchdog': False, 'error': None}
+        self._release_event = asyncio.Event()
+        self.future = engine.submit(self._run())
+
+    # Ask for the release, from any thread. Safe to call more than once.
+    def release(self):
+        self.engine.loop.call_soon_threadsafe(self._release_event.set)
+
+    def _notify(self, callback, *args):
+        if callback is not None:
+            self.engine.call_ui(callback, *args)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            await self.session.write_by_handle(self.data_name, self.press_value, pyads.PLCTYPE_BOOL)
+            self.report['press'] = loop.time() - start
+            self._notify(self.on_pressed, True)
+            try:
+                await asyncio.wait_for(self._release_event.wait(), self.max_hold)
+            except asyncio.TimeoutError:
+                self.report['watchdog'] = True
+                log.warning("%s held longer than %.1f s, released by the watchdog", self.data_name, self.max_hold)
+        except Exception as e:
+            self.report['error'] = str(e)
+            self._notify(self.on_pressed, False)
+        finally:
+            released = loop.time()
+            self.report['hold'] = released - start
+            try:
+                await asyncio.shield(write_release(self.session, {self.data_name: not self.press_value}))
+                self.report['release'] = loop.time() - released
+            except Exception as e:
+                # Logged by write_release
+                self.report['error'] = self.report['error'] or str(e)
+            self._notify(self.on_done, self.report)
+        return self.report
+
+
+# Let the pulses write their release before the session closes
+async def close_session(session, pulses):
+    await asyncio.gather(*(asyncio.wrap_future(pulse.future) for pulse in pulses), return_exceptions=True)
+    await session.close()
+
+
+def format_report(report):
+    parts = []
+    for key in ('press', 'hold', 'release'):
+        if report.get(key) is not None:
+            parts.append(f"{key} {report[key] * 1000:.0f} ms")
+    return ", ".join(parts)
@@ -0,0 +1,154 @@
+import argparse
+import socket
+import struct
+import sys
+import threading
+
+import ads_routes
+
+# Local stand-in for the route service (UDP 48899) of an LGV.
+#
+# Answers add-route requests like the PLC does: the route is added when the
+# password matches, refused otherwise. With --check it runs the client's route
+# provisioning (ads_routes.provision_lgv) against itself and checks that a
+# good password adds the route, a wrong one fails at once without retries, and
+# that a route the local router does not get is reported as remote only.
+#
+#   python ads_route_responder.py --port 48999 --password 1
+#   python ads_route_responder.py --check
+
+RESPONDER_IP_ADDRESS = "127.0.0.1"
+RESPONDER_PORT = 48999             # Next to the real route port, runs without root and beside TwinCAT
+DEFAULT_PASSWORD = "1"
+
+# Bytes 26..28 of the response, as parse_route_response reads them
+RESPONSE_ADDED = b"\x04\x00\x00"
+RESPONSE_REJECTED = b"\x00\x04\x07"
+
+
+def parse_route_request(data):
+    """
+    Fields of an add-route request from ads_routes.build_route_request:
+    {'net_id', 'route_name', 'username', 'password', 'host'}
+    """
+    if len(data) < 24 or data[:4] != b"\x03\x66\x14\x71":
+        raise ValueError("not a route request")
+    fields = {}
+    count = struct.unpack_from("<I", data, 20)[0]
+    pos = 24
+    for _ in range(count):
+        tag, length = struct.unpack_from("<HH", data, pos)
+        value = data[pos + 4:pos + 4 + length]
+        pos += 4 + length
+        if tag == 0x07:
+            fields['net_id'] = ".".join(str(b) for b in value)
+        else:
+            name = {0x0c: 'route_name', 0x0d: 'username', 0x02: 'password', 0x05: 'host'}.get(tag)
+            if name is not None:
+                fields[name] = value.rstrip(b"\0").decode('utf-8')
+    return fields
+
+def build_route_response(request, added):
+    # Response flag in byte 11, sender's AMS address echoed back
+    header = request[:8] + b"\x06\x00\x00\x80" + request[12:20]
+    return header + struct.pack("<I", 1) + b"\x01\x00" + (RESPONSE_ADDED if added else RESPONSE_REJECTED) + b"\x00\x00\x00"
+
+
+class FakeRouteResponder:
+    """
+    Route service of one fake PLC. routes holds the requests it accepted.
+    """
+    def __init__(self, ip_address=RESPONDER_IP_ADDRESS, port=RESPONDER_PORT, password=DEFAULT_PASSWORD):
+        self.ip_address = ip_address
+        self.port = port
+        self.password = password
+        self.routes = []
+        self.requests = 0
+        self.sock = None
+        self.thread = None
+
+    def start(self):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind((self.ip_address, self.port))
+        self.port = self.sock.getsockname()[1]
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.thread.join(5)
+            self.sock = None
+
+    def serve(self):
+        while True:
+            try:
+                data, address = self.sock.recvfrom(1024)
+            except OSError:
+                return
+            try:
+                fields = parse_route_request(data)
+            except (ValueError, struct.error, UnicodeDecodeError):
+                continue
+            self.requests += 1
+            added = fields.get('password') == self.password
+            if added:
+                self.routes.append(fields)
+            self.sock.sendto(build_route_response(data, added), address)
+
+
+####################################################################################################################################################################
+####################################################################### Self-check #################################################################################
+####################################################################################################################################################################
+
+def run_check(responder):
+    lgv = ("LGV-check", "127.0.0.1.1.1", "TC3")
+    # label, password, ADS answers after the add, local routes, expected status and attempts
+    cases = [
+        ("good password", responder.password, True, True, ads_routes.STATUS_ADDED, 1),
+        ("wrong password", responder.password + "x", True, True, ads_routes.STATUS_FAILED, 1),
+        ("no ADS answer", responder.password, False, True, ads_routes.STATUS_FAILED, 3),
+        ("no local route", responder.password, False, False, ads_routes.STATUS_REMOTE_ONLY, 1),
+    ]
+    ok = True
+    for label, password, answers, local_routes, status, attempts in cases:
+        responder.routes.clear()
+        result = ads_routes.provision_lgv(lgv, "Administrator", password, "127.0.0.1.1.1", "check", {},
+                                          attempts=3, retry_delay=0.1, route_host=responder.ip_address, route_port=responder.port,
+                                          local_routes=local_routes, add=add_remote_route,
+                                          verify=lambda *verify_args, answers=answers: answers and bool(responder.routes))
+        passed = result['status'] == status and result['attempts'] == attempts
+        ok = ok and passed
+        print(f"{label:<16} {result['status']:<12} attempts {result['attempts']}  {result['detail']}  {'ok' if passed else 'FAILED'}")
+    return ok
+
+# Sends the request only, the pyads router of this machine is left alone
+def add_remote_route(ip_address, username, password, sending_net_id, route_name, route_host, route_port):
+    request = ads_routes.build_route_request(sending_net_id, ads_routes.local_address_towards(route_host), username, password, route_name)
+    return ads_routes.send_route_request(route_host, request, route_port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the route service of an LGV")
+    parser.add_argument("--ip", default=RESPONDER_IP_ADDRESS)
+    parser.add_argument("--port", type=int, default=RESPONDER_PORT)
+    parser.add_argument("--password", default=DEFAULT_PASSWORD)
+    parser.add_argument("--check", action="store_true", help="provision against the responder and exit")
+    args = parser.parse_args(argv)
+
+    responder = FakeRouteResponder(args.ip, args.port, args.password)
+    responder.start()
+    print(f"Route responder on {responder.ip_address}:{responder.port}")
+    try:
+        if args.check:
+            return 0 if run_check(responder) else 1
+        responder.thread.join()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        responder.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+import os
+import platform
+import socket
+import struct
+import time
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from xml.dom import minidom
+
+import pyads
+
+import ads_network
+from ads_log import log
+
+# Bulk ADS route provisioning.
+#
+# For every LGV: check whether ADS already answers (route present), otherwise
+# add a route to this machine on the PLC through TwinCAT's route service (UDP,
+# the request pyads.add_route_to_plc sends), retrying with a growing delay, and
+# check again. Successful routes are saved to ads_routes.xml so the next run
+# does not check them again, and on Linux, where the pyads router keeps routes
+# in memory only, they are restored at startup.
+# The request is sent here rather than through pyads, which only allows it on
+# Linux and always uses port 48899: the route service host and port are
+# parameters, so a run can be pointed at a local stand-in route responder.
+
+DEFAULT_ROUTES_FILE = "ads_routes.xml"
+DEFAULT_MAX_WORKERS = 8
+DEFAULT_ATTEMPTS = 3
+DEFAULT_RETRY_DELAY = 0.5   # seconds, doubled after every failed attempt
+
+ROUTE_UDP_PORT = pyads.constants.PORT_REMOTE_UDP    # TwinCAT's route service
+ROUTE_REQUEST_TIMEOUT = 5.0
+
+STATUS_KNOWN = "Known"          # saved earlier, not checked
+STATUS_PRESENT = "Present"      # ADS already answered
+STATUS_ADDED = "Added"
+STATUS_REMOTE_ONLY = "Remote only"  # route added on the PLC, the TwinCAT router has none to it
+STATUS_FAILED = "Failed"
+
+# The pyads router (Linux) gets its routes from us. On Windows TwinCAT's router keeps its own,
+# set up in TwinCAT, they cannot be added from here.
+ADD_LOCAL_ROUTES = platform.system() != "Windows"
+
+
+def load_routes(filename=DEFAULT_ROUTES_FILE):
+    routes = {}
+    if os.path.exists(filename):
+        for route in ET.parse(filename).getroot().findall("Route"):
+            routes[route.find("AMSNetId").text] = {
+                'name': route.find("Name").text,
+                'ip': route.find("Address").text,
+                'verified': route.find("Verified").text
+            }
+    return routes
+
+def save_routes(routes, filename=DEFAULT_ROUTES_FILE):
+    route_list = ET.Element("ADSRoutes")
+    for ams_net_id, route in sorted(routes.items()):
+        element = ET.SubElement(route_list, "Route")
+        ET.SubElement(element, "Name").text = route['name']
+        ET.SubElement(element, "AMSNetId").text = ams_net_id
+        ET.SubElement(element, "Address").text = route['ip']
+        ET.SubElement(element, "Verified").text = route['verified']
+
+    xmlstr = minidom.parseString(ET.tostring(route_list, 'utf-8')).toprettyxml(indent="    ")
+    with open(filename, "w", encoding='utf-8') as f:
+        f.write(xmlstr)
+
+# Re-create the in-memory routes of the pyads router (Linux only, TwinCAT keeps its own routes on Windows)
+def restore_local_routes(routes):
+    if not ADD_LOCAL_ROUTES:
+        return
+    for ams_net_id, route in routes.items():
+        try:
+            pyads.add_route(ams_net_id, route['ip'])
+        except Exception as e:
+            log.warning("Could not restore route to %s: %s", ams_net_id, e)
+
+
+# Address of this machine as seen from the PLC's network
+def local_address_towards(ip_address):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        s.connect((ip_address, ads_network.AMS_TCP_PORT))
+        return s.getsockname()[0]
+
+def local_net_id():
+    pyads.open_port()
+    try:
+        return pyads.get_local_address().netid
+    finally:
+        pyads.close_port()
+
+def verify_route(ams_net_id, ads_port, connect_timeout, read_timeout):
+    return ads_network.probe_target(ams_net_id, ads_port, connect_timeout, read_timeout)['state'] is not None
+
+def _field(tag, text):
+    # Strings are sent null terminated, with their length
+    data = (text + "\0").encode('utf-8')
+    return tag + struct.pack("<H", len(data)) + data
+
+def build_route_request(sending_net_id, adding_host_name, username, password, route_name):
+    """
+    Add-route request of the route service, same layout as pyads.add_route_to_plc
+    """
+    net_id = struct.pack(">6B", *map(int, sending_net_id.split(".")))
+    header = b"\x03\x66\x14\x71\x00\x00\x00\x00\x06\x00\x00\x00" + net_id + struct.pack("<H", pyads.PORT_SYSTEMSERVICE)
+    header += _field(b"\x05\x00" + b"\x00\x00\x0c\x00", route_name)
+    data = b"\x07\x00" + struct.pack("<H", 6) + net_id
+    data += _field(b"\x0d\x00", username) + _field(b"\x02\x00", password) + _field(b"\x05\x00", adding_host_name)
+    return header + data
+
+def parse_route_response(data):
+    """
+    True when the route was added, False when the PLC refused the credentials
+    """
+    if len(data) >= 29 and data[11] == 0x80:
+        if data[26:29] == b"\x04\x00\x00":
+            return True
+        if data[26:29] == b"\x00\x04\x07":
+            return False
+    raise Exception(f"Unexpected response from the route service: {data!r}")
+
+def send_route_request(host, request, port=ROUTE_UDP_PORT, timeout=ROUTE_REQUEST_TIMEOUT):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        sock.sendto(request, (host, port))
+        data, address = sock.recvfrom(1024)
+    return parse_route_response(data)
+
+def add_route(ip_address, username, password, sending_net_id, route_name, route_host=None, route_port=ROUTE_UDP_PORT):
+    # The PLC gets a route back to this machine, and the pyads router one to the PLC
+    route_host = route_host or ip_address
+    request = build_route_request(sending_net_id, local_address_towards(route_host), username, password, route_name)
+    added = send_route_request(route_host, request, route_port)
+    if added and ADD_LOCAL_ROUTES:
+        pyads.add_route(f"{ip_address}.1.1", ip_address)
+    return added
+
+
+def provision_lgv(lgv, username, password, sending_net_id, route_name, known_routes, force=False,
+                  attempts=DEFAULT_ATTEMPTS, retry_delay=DEFAULT_RETRY_DELAY,
+                  connect_timeout=ads_network.DEFAULT_CONNECT_TIMEOUT, read_timeout=ads_network.DEFAULT_READ_TIMEOUT,
+                  route_host=None, route_port=ROUTE_UDP_PORT, local_routes=ADD_LOCAL_ROUTES, verify=verify_route, add=add_route):
+    """
+    Returns {'name', 'net_id', 'ip', 'status', 'attempts', 'detail'} for one LGV (name, net_id, type).
+    route_host sends the route request somewhere else than the LGV's address, e.g. a local responder.
+    """
+    lgv_name, ams_net_id, tc_type = lgv
+    ip_address = ads_network.ip_from_net_id(ams_net_id)
+    ads_port = ads_network.ads_port_for(tc_type)
+    result = {'name': lgv_name, 'net_id': ams_net_id, 'ip': ip_address, 'status': STATUS_FAILED, 'attempts': 0, 'detail': ""}
+
+    if ams_net_id in known_routes and not force:
+        result.update(status=STATUS_KNOWN, detail=f"verified {known_routes[ams_net_id]['verified']}")
+        return result
+
+    try:
+        if verify(ams_net_id, ads_port, connect_timeout, read_timeout):
+            result['status'] = STATUS_PRESENT
+            return result
+    except Exception as e:
+        result['detail'] = str(e)
+
+    delay = retry_delay
+    for attempt in range(1, attempts + 1):
+        result['attempts'] = attempt
+        try:
+            if not add(ip_address, username, password, sending_net_id, route_name, route_host, route_port):
+                # Sending a known-bad password again would not help
+                result['detail'] = "route rejected by PLC (check credentials)"
+                return result
+            if verify(ams_net_id, ads_port, connect_timeout, read_timeout):
+                result.update(status=STATUS_ADDED, detail="")
+                return result
+            if not local_routes:
+                # Retrying the remote side cannot fix a route missing in TwinCAT's router
+                result.update(status=STATUS_REMOTE_ONLY, detail="remote route added, local route missing (add it in the TwinCAT router)")
+                return result
+            result['detail'] = "route added but ADS does not answer"
+        except Exception as e:
+            result['detail'] = str(e)
+        if attempt < attempts:
+            time.sleep(delay)
+            delay *= 2
+    return result
+
+def provision_fleet(lgvs, username, password, sending_net_id=None, route_name=None, force=False,
+                    max_workers=DEFAULT_MAX_WORKERS, on_result=None, routes_file=DEFAULT_ROUTES_FILE, **options):
+    """
+    Provision routes to every LGV in parallel. on_result(result) is called from the worker
+    threads as each LGV finishes. Successful routes are saved to routes_file.
+    Returns the results in the order of lgvs.
+    """
+    lgvs = list(lgvs)
+    if not lgvs:
+        return []
+    sending_net_id = sending_net_id or local_net_id()
+    route_name = route_name or socket.gethostname()
+    known_routes = load_routes(routes_file)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(lgvs))) as executor:
+        futures = {executor.submit(provision_lgv, lgv, username, password, sending_net_id, route_name, known_routes, force, **options): lgv
+                   for lgv in lgvs}
+        for future in as_completed(futures):
+            result = future.result()
+            results[result['net_id']] = result
+            if on_result is not None:
+                on_result(result)
+
+    verified = time.strftime("%Y-%m-%d %H:%M:%S")
+    for result in results.values():
+        if result['status'] in (STATUS_PRESENT, STATUS_ADDED):
+            known_routes[result['net_id']] = {'name': result['name'], 'ip': result['ip'], 'verified': verified}
+    save_routes(known_routes, routes_file)
+    return [results[lgv[1]] for lgv in lgvs]
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import os
+
+import pyads
+
+import ads_pulse
+
+# Timed command sequences.
+#
+# A sequence is a list of steps run on the ADS engine loop against one
+# AdsSession, timed on the loop clock and using cached symbol handles:
+#   {"op": "pulse", "symbol": "reset", "hold": 0.3}           write True, hold, write False
+#   {"op": "pulse", "symbol": "stop", "value": false}          inverted pulse (False, then True)
+#   {"op": "pulse", "symbol": ["reset", "run"], "hold": 0.3}  several bits, pressed and released together
+#   {"op": "write", "symbol": "dis_horn", "value": true}
+#   {"op": "delay", "seconds": 1.0}
+#   {"op": "wait", "symbol": "run", "value": true, "timeout": 5}   wait until the variable reads value
+#   {"op": "timeout", "seconds": 15}                           the remaining steps must finish within 15 s
+# Symbols are action names (resolved per TC type and core library by the caller)
+# or raw PLC symbol names. User sequences are read from sequences.json.
+
+DEFAULT_SEQUENCES_FILE = "sequences.json"
+DEFAULT_PULSE_HOLD = 0.3
+DEFAULT_WAIT_TIMEOUT = 5.0
+WAIT_POLL_INTERVAL = 0.05
+
+PREDEFINED_SEQUENCES = {
+    "Recover": [
+        {"op": "timeout", "seconds": 15},
+        {"op": "pulse", "symbol": "reset", "hold": 0.3},
+        {"op": "delay", "seconds": 1.0},
+        {"op": "wait", "symbol": "run", "value": True, "timeout": 5},
+        {"op": "pulse", "symbol": "run", "hold": 0.3},
+    ],
+    "Reset": [
+        {"op": "pulse", "symbol": "reset", "hold": 0.3},
+    ],
+}
+
+STEP_FIELDS = {
+    'pulse': ('symbol',),
+    'write': ('symbol', 'value'),
+    'delay': ('seconds',),
+    'wait': ('symbol',),
+    'timeout': ('seconds',),
+}
+
+
+class SequenceError(Exception):
+    pass
+
+class SequenceTimeout(SequenceError):
+    pass
+
+
+def validate_sequence(name, steps):
+    if not isinstance(steps, list) or not steps:
+        raise SequenceError(f"Sequence '{name}' has no steps")
+    for index, step in enumerate(steps, 1):
+        op = step.get('op')
+        if op not in STEP_FIELDS:
+            raise SequenceError(f"Sequence '{name}', step {index}: unknown op '{op}'")
+        missing = [field for field in STEP_FIELDS[op] if field not in step]
+        if missing:
+            raise SequenceError(f"Sequence '{name}', step {index}: missing {', '.join(missing)}")
+
+def load_sequences(filename=DEFAULT_SEQUENCES_FILE):
+    """
+    Predefined sequences, plus (or overridden by) the user sequences in filename
+    """
+    sequences = dict(PREDEFINED_SEQUENCES)
+    if os.path.exists(filename):
+        with open(filename, "r", encoding='utf-8') as f:
+            user_sequences = json.load(f)
+        for name, steps in user_sequences.items():
+            validate_sequence(name, steps)
+        sequences.update(user_sequences)
+    return sequences
+
+
+async def _wait_until(session, name, expected, timeout, loop):
+    deadline = loop.time() + timeout
+    while True:
+        if await session.read_by_handle(name, pyads.PLCTYPE_BOOL) == expected:
+            return
+        if loop.time() >= deadline:
+            raise SequenceTimeout(f"{name} did not become {expected} within {timeout} s")
+        await asyncio.sleep(min(WAIT_POLL_INTERVAL, max(0.0, deadline - loop.time())))
+
+async def _run_step(session, step, resolve, loop):
+    op = step['op']
+    if op == 'pulse':
+        symbols = step['symbol'] if isinstance(step['symbol'], list) else [step['symbol']]
+        value = bool(step.get('value', True))
+        # Released even when the sequence is cancelled or times out meanwhile
+        await ads_pulse.pulse(session, {resolve('write', symbol): value for symbol in symbols}, step.get('hold', DEFAULT_PULSE_HOLD))
+    elif op == 'write':
+        await session.write_by_handle(resolve('write', step['symbol']), bool(step['value']), pyads.PLCTYPE_BOOL)
+    elif op == 'delay':
+        await asyncio.sleep(step['seconds'])
+    elif op == 'wait':
+        await _wait_until(session, resolve('read', step['symbol']), bool(step.get('value', True)), step.get('timeout', DEFAULT_WAIT_TIMEOUT), loop)
+
+async def run_sequence(session, steps, resolve, on_step=None):
+    """
+    Run steps on session. resolve(kind, symbol) returns the PLC symbol to 'write' or 'read'.
+    on_step(index, step, seconds) is called after every step. Returns [(op, seconds), ...].
+    """
+    loop = asyncio.get_running_loop()
+    deadline = None
+    timings = []
+    for index, step in enumerate(steps, 1):
+        start = loop.time()
+        if step['op'] == 'timeout':
+            deadline = start + step['seconds']
+            continue
+        try:
+            if deadline is None:
+                await _run_step(session, step, resolve, loop)
+            else:
+                await asyncio.wait_for(_run_step(session, step, resolve, loop), max(0.0, deadline - start))
+        except asyncio.TimeoutError:
+            if deadline is not None and loop.time() >= deadline:
+                raise SequenceTimeout(f"Step {index} ({step['op']}) exceeded the sequence timeout")
+            raise
+        elapsed = loop.time() - start
+        timings.append((step['op'], elapsed))
+        if on_step is not None:
+            on_step(index, step, elapsed)
+    return timings
@@ -0,0 +1,289 @@
+import argparse
+import asyncio
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import sys
+import threading
+import time
+
+import pyads
+
+import ads_engine
+import ads_pulse
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Soak test for thread, handle and memory leaks.
+#
+# Runs headless against a local fake ADS server (pyads.testserver) and repeats
+# the client's connection cycle thousands of times with the client's own code
+# (AdsSession, ads_engine.poll_values, ads_pulse.HeldPulse and close_session):
+# connect, poll the lamps every 100 ms, hold the command buttons, disconnect,
+# with the server randomly dropped and restarted in between. Thread count,
+# open handles, RSS and poll-loop jitter are sampled along the way. The run
+# fails (exit code 1) when any of them keeps growing from the start of the run
+# to its end, cannot be sampled, or when too many cycles fail.
+#
+#   python ads_soak.py --cycles 5000 --drop-probability 0.02
+
+FAKE_IP_ADDRESS = "127.0.0.1"
+FAKE_NET_ID = "127.0.0.1.1.1"
+FAKE_ADS_PORT = 851
+
+MAX_ERROR_RATE = 0.05       # Failed cycles allowed, drops included
+
+# TC3 symbols of the client without core library
+POLLED_SYMBOLS = ["SafetyControls.alert.out.lampRunButton", "Output.DisableHorn"]
+PULSED_SYMBOLS = ["Load_Handling.ADS_Reset", "Load_Handling.ADS_Run", "Load_Handling.ADS_MCD_Mode"]
+
+# Allowed growth between the start and the end of the run (medians of the first and last third of the samples)
+GROWTH_LIMITS = {
+    'threads': 2,
+    'handles': 10,
+    'rss': 20 * 1024 * 1024,
+    'jitter': 0.05,
+}
+
+
+####################################################################################################################################################################
+#################################################################### Fake ADS server ###############################################################################
+####################################################################################################################################################################
+
+def serve_fake_plc(ip_address, ready):
+    from pyads.testserver import AdsTestServer, AdvancedHandler, PLCVariable
+    handler = AdvancedHandler()
+    for name in POLLED_SYMBOLS + PULSED_SYMBOLS:
+        handler.add_variable(PLCVariable(name, bytes([0]), ads_type=pyads.constants.ADST_BIT, symbol_type="BOOL"))
+    server = AdsTestServer(handler=handler, ip_address=ip_address, logging=False)
+    server.start()
+    time.sleep(0.2)
+    ready.set()
+    server.join()
+
+class FakeAdsServer:
+    """
+    pyads test server with the client's symbols, can be dropped and restarted. Runs in its own
+    process, so its threads and memory do not count as the client's.
+    """
+    def __init__(self, ip_address=FAKE_IP_ADDRESS):
+        self.ip_address = ip_address
+        self.process = None
+        self.drops = 0
+
+    def start(self):
+        ready = multiprocessing.Event()
+        self.process = multiprocessing.Process(target=serve_fake_plc, args=(self.ip_address, ready), daemon=True)
+        self.process.start()
+        if not ready.wait(10):
+            raise RuntimeError("Fake ADS server did not start")
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.join(5)
+            self.process = None
+
+    # Drop every client connection, then come back after pause seconds
+    def drop(self, pause):
+        self.drops += 1
+        self.stop()
+        time.sleep(pause)
+        self.start()
+
+
+####################################################################################################################################################################
+####################################################################### Metrics ####################################################################################
+####################################################################################################################################################################
+
+def open_handles():
+    if psutil is not None:
+        process = psutil.Process()
+        return process.num_handles() if hasattr(process, 'num_handles') else process.num_fds()
+    if os.path.isdir("/proc/self/fd"):
+        return len(os.listdir("/proc/self/fd"))
+    return None
+
+def rss_bytes():
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def check_growth(samples, key, limit):
+    """
+    Returns (first, last, grew) from the medians of the first and last third of the samples, None without enough data
+    """
+    values = [sample[key] for sample in samples if sample[key] is not None]
+    if len(values) < 6:
+        return None
+    third = len(values) // 3
+    first, last = statistics.median(values[:third]), statistics.median(values[-third:])
+    return first, last, last - first > limit
+
+
+####################################################################################################################################################################
+##################################################################### Soak cycles ##################################################################################
+####################################################################################################################################################################
+
+def restore_route(net_id, ads_port, ip_address):
+    # The pyads router on Linux keeps a broken route after the server drops the connection
+    if platform.system() == "Windows":
+        return
+    try:
+        pyads.delete_route(pyads.AmsAddr(net_id, ads_port))
+    except Exception:
+        pass
+    pyads.add_route(net_id, ip_address)
+
+async def soak_cycle(engine, server, rng, args, stats, jitters):
+    loop = asyncio.get_running_loop()
+    session = ads_engine.AdsSession(engine, args.net_id, args.port, args.connect_timeout, args.read_timeout)
+    poll = None
+    pulses = []
+    last_poll = None
+    dropped = False
+
+    def on_values(values):
+        nonlocal last_poll
+        now = loop.time()
+        if last_poll is not None:
+            jitters.append(abs(now - last_poll - ads_engine.POLL_INTERVAL))
+        last_poll = now
+        if None in values.values():
+            stats['read_errors'] += 1
+
+    def on_pulse_done(report):
+        stats['writes'] += 2
+        if report['error']:
+            stats['pulse_errors'] += 1
+
+    try:
+        await session.connect()
+        await ads_engine.check_running(session)
+        poll = asyncio.ensure_future(ads_engine.poll_values(session, {name: name for name in POLLED_SYMBOLS}, on_values))
+
+        # Held like the GUI buttons: released by the caller, or by the watchdog when held too long
+        for symbol in rng.sample(PULSED_SYMBOLS, k=rng.randint(1, len(PULSED_SYMBOLS))):
+            pulse = ads_pulse.HeldPulse(engine, session, symbol, max_hold=args.max_hold, on_done=on_pulse_done)
+            pulses.append(pulse)
+            if rng.random() < 0.9:
+                loop.call_later(rng.uniform(0, args.hold), pulse.release)
+
+        await asyncio.sleep(rng.uniform(0, args.hold))
+        if poll.done():
+            poll.result()
+        if server is not None and rng.random() < args.drop_probability:
+            await loop.run_in_executor(None, server.drop, rng.uniform(0, 0.5))
+            # The poll task has to notice the drop, like the GUI's connection monitor
+            await asyncio.sleep(2 * ads_engine.POLL_INTERVAL)
+            dropped = True
+        stats['ok'] += 1
+    except Exception as e:
+        stats['errors'] += 1
+        stats['last_error'] = f"{type(e).__name__}: {e}"
+    finally:
+        if poll is not None:
+            poll.cancel()
+            await asyncio.gather(poll, return_exceptions=True)
+        for pulse in pulses:
+            pulse.release()
+        await ads_pulse.close_session(session, pulses)
+        if dropped:
+            await loop.run_in_executor(None, restore_route, args.net_id, args.port, FAKE_IP_ADDRESS)
+
+def sample(cycle, jitters):
+    return {
+        'cycle': cycle,
+        'threads': threading.active_count(),
+        'handles': open_handles(),
+        'rss': rss_bytes(),
+        'jitter': percentile(jitters, 0.95),
+    }
+
+def run_soak(args):
+    server = None
+    if not args.no_server:
+        server = FakeAdsServer()
+        server.start()
+        restore_route(args.net_id, args.port, FAKE_IP_ADDRESS)
+
+    engine = ads_engine.AdsEngine().start()
+    rng = random.Random(args.seed)
+    stats = {'ok': 0, 'errors': 0, 'writes': 0, 'read_errors': 0, 'pulse_errors': 0, 'last_error': None}
+    samples = []
+    jitters = []
+    start = time.monotonic()
+    try:
+        for cycle in range(1, args.cycles + 1):
+            engine.run(soak_cycle(engine, server, rng, args, stats, jitters))
+            if cycle % args.sample_every == 0:
+                samples.append(sample(cycle, jitters))
+                jitters.clear()
+                print(f"cycle {cycle}: {samples[-1]['threads']} threads, {samples[-1]['handles']} handles, "
+                      f"rss {samples[-1]['rss']}, jitter p95 {samples[-1]['jitter']}, {stats['errors']} errors")
+    finally:
+        engine.stop()
+        if server is not None:
+            server.stop()
+
+    # Ignore the warm-up, caches and pools fill up there
+    samples = samples[len(samples) // 10:]
+    failed = False
+    print(f"\n{stats['ok']} cycles ok, {stats['errors']} failed, {stats['writes']} writes, "
+          f"{stats['read_errors']} poll errors, {stats['pulse_errors']} pulse errors, "
+          f"{server.drops if server else 0} drops in {time.monotonic() - start:.0f} s")
+    if stats['last_error']:
+        print(f"last error: {stats['last_error']}")
+    for key, limit in GROWTH_LIMITS.items():
+        result = check_growth(samples, key, limit)
+        if result is None:
+            # Without samples the run proves nothing about this metric
+            print(f"{key}: not enough samples  FAILED")
+            failed = True
+            continue
+        first, last, grew = result
+        print(f"{key}: {first} -> {last}{'  GROWING' if grew else ''}")
+        failed = failed or grew
+    cycles = stats['ok'] + stats['errors']
+    error_rate = stats['errors'] / cycles if cycles else 1.0
+    if error_rate > args.max_error_rate:
+        print(f"error rate {error_rate:.1%} above {args.max_error_rate:.1%}  FAILED")
+        failed = True
+    return not failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Connect/poll/write/disconnect soak test against a local fake ADS server")
+    parser.add_argument("--cycles", type=int, default=2000)
+    parser.add_argument("--hold", type=float, default=0.5, help="max seconds of polling per cycle")
+    parser.add_argument("--max-hold", type=float, default=ads_pulse.DEFAULT_MAX_HOLD, help="watchdog of the held buttons")
+    parser.add_argument("--max-error-rate", type=float, default=MAX_ERROR_RATE)
+    parser.add_argument("--drop-probability", type=float, default=0.02)
+    parser.add_argument("--sample-every", type=int, default=50)
+    parser.add_argument("--connect-timeout", type=float, default=1.0)
+    parser.add_argument("--read-timeout", type=float, default=1.0)
+    parser.add_argument("--net-id", default=FAKE_NET_ID)
+    parser.add_argument("--port", type=int, default=FAKE_ADS_PORT)
+    parser.add_argument("--no-server", action="store_true", help="use an ADS server that is already running")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+    return 0 if run_soak(args) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
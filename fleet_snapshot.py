@@ -0,0 +1,127 @@
+import json
+import os
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import ads_network
+
+# Cross-fleet variable snapshot.
+#
+# Reads the same list of symbols from every LGV of the fleet in parallel (one
+# sum-read per vehicle, bounded number of vehicles at a time), stores the result
+# as JSON and finds the vehicles whose values differ from the rest of the fleet
+# or from an earlier snapshot.
+
+SNAPSHOT_DIR = "snapshots"
+DEFAULT_MAX_WORKERS = 8
+
+
+def read_symbols(connection, plc_names):
+    """
+    Read {label: plc_name} with one sum-read. If the batch fails (usually an unknown symbol on
+    one vehicle), fall back to single reads so the other symbols are still reported.
+    Returns (values, errors), both keyed by label.
+    """
+    values, errors = {}, {}
+    if not plc_names:
+        return values, errors
+    try:
+        result = connection.read_list_by_name(sorted(set(plc_names.values())))
+        for label, plc_name in plc_names.items():
+            if ads_network.is_sum_read_error(result[plc_name]):
+                errors[label] = result[plc_name]
+            else:
+                values[label] = result[plc_name]
+    except Exception:
+        for label, plc_name in plc_names.items():
+            try:
+                values[label] = connection.read_by_name(plc_name)
+            except Exception as e:
+                errors[label] = str(e)
+    return values, errors
+
+def read_lgv(lgv, symbols, resolve_symbols, connect_timeout, read_timeout):
+    """
+    Snapshot of one LGV. resolve_symbols(connection, tc_type, symbols) maps the requested symbols to
+    ({label: plc_name}, {label: value}), the second dict holding values known without reading (e.g. core library).
+    """
+    lgv_name, ams_net_id, tc_type = lgv
+    entry = {'net_id': ams_net_id, 'type': tc_type, 'values': {}, 'errors': {}, 'error': None}
+    connection = None
+    try:
+        ads_network.check_reachable(ams_net_id, connect_timeout)
+        connection = ads_network.open_connection(ams_net_id, ads_network.ads_port_for(tc_type), read_timeout)
+        plc_names, known_values = resolve_symbols(connection, tc_type, symbols)
+        entry['values'], entry['errors'] = read_symbols(connection, plc_names)
+        entry['values'].update(known_values)
+    except Exception as e:
+        entry['error'] = str(e)
+    finally:
+        if connection is not None:
+            try:
+                connection.close()
+            except Exception:
+                pass
+    # Keep the file readable, PLC structures and arrays end up as their repr
+    entry['values'] = {label: value if isinstance(value, (bool, int, float, str)) or value is None else str(value)
+                       for label, value in entry['values'].items()}
+    return lgv_name, entry
+
+def take_snapshot(lgvs, symbols, resolve_symbols, max_workers=DEFAULT_MAX_WORKERS,
+                  connect_timeout=ads_network.DEFAULT_CONNECT_TIMEOUT, read_timeout=ads_network.DEFAULT_READ_TIMEOUT):
+    lgvs = list(lgvs)
+    snapshot = {'taken_at': time.strftime("%Y-%m-%d %H:%M:%S"), 'symbols': list(symbols), 'lgvs': {}}
+    if not lgvs:
+        return snapshot
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(lgvs))) as executor:
+        for lgv_name, entry in executor.map(lambda lgv: read_lgv(lgv, symbols, resolve_symbols, connect_timeout, read_timeout), lgvs):
+            snapshot['lgvs'][lgv_name] = entry
+    return snapshot
+
+
+def save_snapshot(snapshot, directory=SNAPSHOT_DIR):
+    os.makedirs(directory, exist_ok=True)
+    stem = os.path.join(directory, "snapshot_" + snapshot['taken_at'].replace("-", "").replace(":", "").replace(" ", "_"))
+    # Never overwrite a snapshot taken within the same second
+    filename, count = stem + ".json", 1
+    while True:
+        try:
+            with open(filename, "x", encoding='utf-8') as f:
+                json.dump(snapshot, f, indent=4)
+            return filename
+        except FileExistsError:
+            count += 1
+            filename = f"{stem}_{count}.json"
+
+def load_snapshot(filename):
+    with open(filename, "r", encoding='utf-8') as f:
+        return json.load(f)
+
+
+def find_outliers(snapshot):
+    """
+    For every symbol, the value held by most vehicles is taken as reference.
+    Returns ({symbol: reference value}, set of (lgv_name, symbol) that differ from it).
+    """
+    references, outliers = {}, set()
+    for symbol in snapshot['symbols']:
+        read = {lgv_name: entry['values'][symbol] for lgv_name, entry in snapshot['lgvs'].items() if symbol in entry['values']}
+        if not read:
+            continue
+        reference = Counter(json.dumps(value) for value in read.values()).most_common(1)[0][0]
+        references[symbol] = json.loads(reference)
+        outliers.update((lgv_name, symbol) for lgv_name, value in read.items() if json.dumps(value) != reference)
+    return references, outliers
+
+def compare_snapshots(previous, current):
+    """
+    Returns {(lgv_name, symbol): previous value} for every value that changed since the previous snapshot.
+    """
+    changes = {}
+    for lgv_name, entry in current['lgvs'].items():
+        previous_values = previous.get('lgvs', {}).get(lgv_name, {}).get('values', {})
+        for symbol, value in entry['values'].items():
+            if symbol in previous_values and previous_values[symbol] != value:
+                changes[(lgv_name, symbol)] = previous_values[symbol]
+    return changes
@@ -0,0 +1,132 @@
+import ipaddress
+from concurrent.futures import ThreadPoolExecutor
+
+import ads_network
+from ads_log import log
+
+# Automatic LGV discovery.
+#
+# Probes a range of IP addresses for ADS endpoints, many at a time with short
+# timeouts, and reads the TwinCAT version of every endpoint that answers to pick
+# TC3 (port 851) or TC2 (port 801). The AMS TCP port and the connection factory
+# can be overridden, so a scan can run against local fake endpoints. An endpoint
+# whose AMS port answers but that has no route to us yet cannot tell its version,
+# it is kept with an unknown type.
+
+DEFAULT_MAX_WORKERS = 32
+MAX_ADDRESSES = 4096        # Refuse ranges that would take minutes to scan
+TC3_PORT = 851
+TC2_PORT = 801
+DEFAULT_TYPE = "TC3"        # New LGVs of unknown type, most of the fleet runs TwinCAT 3
+
+
+def parse_ip_range(spec):
+    """
+    "10.40.10.0/24", "10.40.10.70-99", "10.40.10.70-10.40.10.99" or a single address.
+    Several ranges can be separated by commas. Returns the addresses as strings.
+    """
+    addresses = []
+
+    # Checked before expanding, a typo like /8 would otherwise build millions of addresses
+    def check_size(count):
+        if len(addresses) + count > MAX_ADDRESSES:
+            raise ValueError(f"Range too large, at most {MAX_ADDRESSES} addresses")
+
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "/" in part:
+            network = ipaddress.ip_network(part, strict=False)
+            check_size(network.num_addresses)
+            hosts = list(network.hosts()) or [network.network_address]
+            addresses.extend(str(ip) for ip in hosts)
+        elif "-" in part:
+            first, last = (item.strip() for item in part.split("-", 1))
+            if "." not in last:
+                last = first.rsplit(".", 1)[0] + "." + last
+            start, end = int(ipaddress.ip_address(first)), int(ipaddress.ip_address(last))
+            if end < start:
+                raise ValueError(f"Invalid range '{part}'")
+            check_size(end - start + 1)
+            addresses.extend(str(ipaddress.ip_address(value)) for value in range(start, end + 1))
+        else:
+            check_size(1)
+            addresses.append(str(ipaddress.ip_address(part)))
+    return addresses
+
+def net_id_for_ip(ip_address):
+    # LGV net ids are "<ip>.1.1"
+    return f"{ip_address}.1.1"
+
+
+def read_twincat_version(ams_net_id, ads_port, read_timeout, open_connection):
+    connection = open_connection(ams_net_id, ads_port, read_timeout)
+    try:
+        device_name, version = connection.read_device_info()
+        return device_name, version.version
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+def probe_ip(ip_address, connect_timeout=ads_network.DEFAULT_CONNECT_TIMEOUT, read_timeout=ads_network.DEFAULT_READ_TIMEOUT,
+             ams_tcp_port=ads_network.AMS_TCP_PORT, open_connection=ads_network.open_connection):
+    """
+    Returns {'ip', 'net_id', 'type', 'device', 'version'} for an ADS endpoint, None if nothing answers.
+    type, device and version are None when the version cannot be read (no route yet).
+    """
+    if not ads_network.is_reachable(ip_address, ams_tcp_port, connect_timeout):
+        return None
+
+    ams_net_id = net_id_for_ip(ip_address)
+    errors = []
+    for ads_port in (TC3_PORT, TC2_PORT):
+        try:
+            device_name, major = read_twincat_version(ams_net_id, ads_port, read_timeout, open_connection)
+        except Exception as e:
+            errors.append(f"{ads_port}: {e}")
+            continue
+        return {
+            'ip': ip_address,
+            'net_id': ams_net_id,
+            'type': "TC3" if major >= 3 else "TC2",
+            'device': device_name,
+            'version': major
+        }
+    log.info("ADS endpoint %s answers but its version cannot be read, no route? (%s)", ip_address, "; ".join(errors))
+    return {'ip': ip_address, 'net_id': ams_net_id, 'type': None, 'device': None, 'version': None}
+
+def discover(ip_addresses, max_workers=DEFAULT_MAX_WORKERS, connect_timeout=ads_network.DEFAULT_CONNECT_TIMEOUT,
+             read_timeout=ads_network.DEFAULT_READ_TIMEOUT, ams_tcp_port=ads_network.AMS_TCP_PORT,
+             open_connection=ads_network.open_connection):
+    ip_addresses = list(ip_addresses)
+    if not ip_addresses:
+        return []
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(ip_addresses))) as executor:
+        results = executor.map(lambda ip: probe_ip(ip, connect_timeout, read_timeout, ams_tcp_port, open_connection), ip_addresses)
+        return [result for result in results if result is not None]
+
+
+def merge_discovered(fleet, discovered):
+    """
+    Merge discovered endpoints into the fleet, a list of (name, net_id, type).
+    Known vehicles keep their name and get the detected TC type, new ones are appended.
+    An unknown type leaves a known vehicle as it is, a new one gets DEFAULT_TYPE.
+    Returns (merged fleet, number added, number updated).
+    """
+    merged = [list(lgv) for lgv in fleet]
+    by_net_id = {lgv[1]: lgv for lgv in merged}
+    added = updated = 0
+    for endpoint in discovered:
+        lgv = by_net_id.get(endpoint['net_id'])
+        if lgv is None:
+            lgv = [f"LGV-{endpoint['ip']}", endpoint['net_id'], endpoint['type'] or DEFAULT_TYPE]
+            merged.append(lgv)
+            by_net_id[endpoint['net_id']] = lgv
+            added += 1
+        elif endpoint['type'] is not None and lgv[2] != endpoint['type']:
+            lgv[2] = endpoint['type']
+            updated += 1
+    return [tuple(lgv) for lgv in merged], added, updated